@@ -0,0 +1,89 @@
+"""检查DateDimension和原来基于pendulum和NotionHelper的计算结果是否一致，并比较耗时
+
+    python script/bench_date_dimension.py
+
+覆盖跨年和ISO周跨年的日期（比如2020-12-31属于2020年第53周，2021-01-03
+属于2020年第53周，2024-12-30属于2025年第1周）。
+"""
+import time
+from datetime import datetime, timedelta, timezone
+
+import pendulum
+
+from todo2notion.date_dimension import CHINESE_WEEKDAYS, DateDimension
+from todo2notion.notion_helper import NotionHelper
+
+RANGES = [
+    ("2019-12-20", "2020-01-10"),
+    ("2020-12-20", "2021-01-10"),
+    ("2024-12-20", "2025-01-10"),
+    ("2026-12-20", "2027-01-10"),
+]
+
+
+class RecordingHelper(NotionHelper):
+    """不创建Notion client，get_relation_id返回标题和日期属性"""
+
+    def __init__(self):
+        self.day_database_id = "day"
+        self.week_database_id = "week"
+        self.month_database_id = "month"
+        self.year_database_id = "year"
+
+    def get_relation_id(self, name, id, icon, properties={}):
+        # 原来“日”的日期带有任务的时间，维度表使用当天0点，所以只比较日期部分
+        return f"{id}|{name}|{properties['日期']['date']['start'][:10]}|{properties['日期']['date']['end']}"
+
+
+def get_timestamps():
+    result = []
+    for start, end in RANGES:
+        day = datetime.fromisoformat(start).replace(tzinfo=timezone(timedelta(hours=8)))
+        last = datetime.fromisoformat(end).replace(tzinfo=timezone(timedelta(hours=8)))
+        while day <= last:
+            # 北京时间的凌晨、中午和深夜，UTC时间可能在前一天
+            for hour in (0, 7, 12, 23):
+                result.append(int((day + timedelta(hours=hour, minutes=30)).timestamp()))
+            day += timedelta(days=1)
+    return result
+
+
+def old_enrich(helper, timestamp):
+    """原来add_task_to_notion中的计算方式"""
+    date = pendulum.parse(
+        pendulum.from_timestamp(timestamp).format("YYYY-MM-DDTHH:mm:ss.000ZZ")
+    )
+    date = date.in_timezone("Asia/Shanghai")
+    properties = {}
+    helper.get_date_relation(properties, date)
+    return CHINESE_WEEKDAYS[date.day_of_week], properties
+
+
+def new_enrich(dimension, timestamp):
+    properties = {}
+    dimension.get_date_relation(properties, timestamp)
+    return dimension.get_weekday(timestamp), properties
+
+
+if __name__ == "__main__":
+    helper = RecordingHelper()
+    timestamps = get_timestamps()
+    start = time.perf_counter()
+    old = [old_enrich(helper, x) for x in timestamps]
+    old_time = time.perf_counter() - start
+    start = time.perf_counter()
+    dimension = DateDimension(helper)
+    dimension.prepare(timestamps)
+    new = [new_enrich(dimension, x) for x in timestamps]
+    new_time = time.perf_counter() - start
+    mismatches = 0
+    for timestamp, (old_weekday, old_properties), (new_weekday, new_properties) in zip(
+        timestamps, old, new
+    ):
+        if old_weekday != new_weekday or old_properties != new_properties:
+            mismatches += 1
+            if mismatches <= 5:
+                print(timestamp, old_weekday, old_properties)
+                print(timestamp, new_weekday, new_properties)
+    print(f"{len(timestamps)}个时间，原来{old_time * 1000:.1f}ms，维度表{new_time * 1000:.1f}ms")
+    print(f"结果不一致 {mismatches}个")
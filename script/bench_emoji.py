@@ -0,0 +1,78 @@
+"""比较split_emoji_from_string和原来基于emoji.emoji_list的实现
+
+    python script/bench_emoji.py --names 5000
+"""
+import argparse
+import random
+import time
+
+import emoji
+
+from todo2notion import utils
+
+
+def split_emoji_from_string_v1(s):
+    """原来的实现，扫描整个字符串"""
+    l = list(filter(lambda x: x.get("match_start") == 0, emoji.emoji_list(s)))
+    if len(l) > 0:
+        return l[0].get("emoji"), s[l[0].get("match_end") :]
+    else:
+        return "✅", s
+
+
+def make_names(count):
+    """生成清单名称，包含普通文字、各种emoji开头、肤色和ZWJ组合"""
+    random.seed(0)
+    emojis = list(emoji.EMOJI_DATA)
+    words = ["工作", "生活", "Reading list", "购物", "Inbox", "项目 2024", "学习计划"]
+    names = []
+    for i in range(count):
+        word = random.choice(words) * random.randint(1, 5)
+        kind = i % 5
+        if kind == 0:
+            names.append(word)
+        elif kind == 1:
+            names.append(random.choice(emojis) + word)
+        elif kind == 2:
+            names.append(random.choice(emojis) + " " + word)
+        elif kind == 3:
+            names.append(random.choice(emojis) + "‍" + random.choice(emojis) + word)
+        else:
+            names.append(word + random.choice(emojis))
+    return names
+
+
+def bench(func, names):
+    start = time.perf_counter()
+    results = [func(name) for name in names]
+    return time.perf_counter() - start, results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--names", type=int, default=5000)
+    options = parser.parse_args()
+    names = make_names(options.names)
+    # 全部emoji也作为名称检查一遍结果是否一致
+    all_emojis = [e + "清单" for e in emoji.EMOJI_DATA]
+
+    start = time.perf_counter()
+    utils.get_emoji_tree()
+    build = time.perf_counter() - start
+    old, old_results = bench(split_emoji_from_string_v1, names + all_emojis)
+    cold, new_results = bench(utils.split_emoji_from_string.__wrapped__, names + all_emojis)
+    warm, _ = bench(utils.split_emoji_from_string, names)
+    warm, _ = bench(utils.split_emoji_from_string, names)
+    mismatches = [
+        (name, a, b)
+        for name, a, b in zip(names + all_emojis, old_results, new_results)
+        if a != b
+    ]
+    total = len(names) + len(all_emojis)
+    print(f"前缀树构建 {build * 1000:.1f}ms")
+    print(f"emoji_list {old * 1000:>8.1f}ms ({total}个名称)")
+    print(f"前缀树     {cold * 1000:>8.1f}ms ({total}个名称)")
+    print(f"缓存命中   {warm * 1000:>8.1f}ms ({len(names)}个名称)")
+    print(f"结果不一致 {len(mismatches)}个")
+    for name, a, b in mismatches[:10]:
+        print(f"    {name!r}: {a!r} != {b!r}")
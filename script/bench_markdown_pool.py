@@ -0,0 +1,63 @@
+"""进程池转换Markdown的吞吐量随进程数的变化
+
+    python script/bench_markdown_pool.py --notes 2000 --workers 1,2,4,8
+
+inline是在当前进程中逐个转换，和原来在同步线程中转换一样；其他是进程池中的进程数，
+包括启动进程的时间。加速比接近进程数说明转换是CPU密集的，可以按核数扩展。
+"""
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from todo2notion.notion_renderer import render_markdown_blocks
+
+
+def make_note(i):
+    """一条有标题、列表、代码、表格和链接的笔记"""
+    random.seed(i)
+    parts = [f"# 笔记 {i}"]
+    for j in range(random.randint(3, 8)):
+        parts.append(
+            f"## 第{j}节\n\n"
+            + " ".join(f"**重点{k}** 和 *说明* [链接](https://example.com/{i}/{k})" for k in range(10))
+        )
+        parts.append("\n".join(f"- [{'x' if k % 2 else ' '}] 事项 {k} `code`" for k in range(8)))
+        parts.append(f"```python\nfor x in range({j}):\n    print(x)\n```")
+        parts.append(
+            "| 列1 | 列2 | 列3 |\n| --- | --- | --- |\n"
+            + "\n".join(f"| {k} | **{k * 2}** | 文本 |" for k in range(5))
+        )
+    return "\n\n".join(parts)
+
+
+def run_inline(notes):
+    return sum(len(render_markdown_blocks(x)) for x in notes)
+
+
+def run_pool(notes, workers):
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return sum(len(x) for x in pool.map(render_markdown_blocks, notes, chunksize=8))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--notes", type=int, default=2000)
+    parser.add_argument("--workers", default=",".join(str(2**i) for i in range(4)))
+    options = parser.parse_args()
+    notes = [make_note(i) for i in range(options.notes)]
+    size = sum(len(x) for x in notes)
+    print(f"{len(notes)}条笔记，共{size / 1e6:.1f}M字符，{os.cpu_count()}个CPU")
+    start = time.perf_counter()
+    blocks = run_inline(notes)
+    baseline = time.perf_counter() - start
+    print(f"{'inline':<8}耗时{baseline:>7.2f}s {len(notes) / baseline:>8.0f}条/秒 {blocks} blocks")
+    for workers in (int(x) for x in options.workers.split(",")):
+        start = time.perf_counter()
+        run_pool(notes, workers)
+        duration = time.perf_counter() - start
+        print(
+            f"{workers:<8}耗时{duration:>7.2f}s {len(notes) / duration:>8.0f}条/秒 "
+            f"加速{baseline / duration:>5.2f}x"
+        )
@@ -0,0 +1,111 @@
+"""解析batch/check返回的任务的耗时和内存
+
+    python script/bench_models.py --tasks 50000
+
+dict是原来的方式：json解析成dict，同步时每个任务多次用pendulum解析时间；
+model是解析成Task，时间在解析时计算好；stream是边读边解析成Task；
+diff是省内存模式，解析出来的任务都没有修改被丢弃。
+常驻是解析结果的大小，峰值包括解析过程中的临时数据，都不包括响应本身。
+"""
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+
+from todo2notion import utils
+from todo2notion.models import Task, loads
+from todo2notion.stream import JsonStream
+
+
+def make_payload(count):
+    random.seed(0)
+    tasks = []
+    for i in range(count):
+        day = random.randint(1, 28)
+        task = {
+            "id": f"{i:024x}",
+            "projectId": f"{i % 50:024x}",
+            "title": f"任务 {i}",
+            "content": "内容 " * random.randint(0, 50),
+            "tags": random.sample(["工作", "生活", "学习", "阅读"], random.randint(0, 2)),
+            "sortOrder": -i,
+            "priority": 0,
+            "status": 0,
+            "startDate": f"2024-01-{day:02d}T00:00:00.000+0000",
+            "dueDate": f"2024-02-{day:02d}T00:00:00.000+0000",
+            "modifiedTime": f"2024-03-{day:02d}T12:34:56.000+0000",
+            "reminders": [],
+            "items": [
+                {"id": f"{i:020x}{j:04x}", "title": f"子任务 {j}", "status": 0}
+                for j in range(random.randint(0, 3))
+            ],
+        }
+        if i % 3 == 0:
+            task["completedTime"] = f"2024-03-{day:02d}T08:00:00.000+0000"
+        tasks.append(task)
+    payload = {"checkPoint": 1, "syncTaskBean": {"update": tasks}}
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+def use_dicts(content):
+    tasks = json.loads(content).get("syncTaskBean").get("update")
+    # is_task_modified、排序、get_task_time、add_task_to_notion中各解析一次
+    for item in tasks:
+        for key in ("modifiedTime", "modifiedTime", "startDate", "completedTime"):
+            if item.get(key):
+                utils.parse_date(item.get(key))
+    return tasks
+
+
+def use_models(content):
+    return [Task.from_dict(x) for x in loads(content).get("syncTaskBean").get("update")]
+
+
+def use_stream(content, keep=True):
+    """模拟边下载边解析，keep为False时相当于省内存模式下所有任务都没有修改"""
+    chunks = (content[i : i + 65536] for i in range(0, len(content), 65536))
+    stream = JsonStream(chunks, ("syncTaskBean", "update"))
+    tasks = []
+    for x in stream:
+        task = Task.from_dict(x)
+        if keep:
+            tasks.append(task)
+    return tasks
+
+
+def measure(func, content):
+    """tracemalloc会拖慢分配，耗时和内存分开测"""
+    gc.collect()
+    start = time.perf_counter()
+    result = func(content)
+    duration = time.perf_counter() - start
+    del result
+    gc.collect()
+    tracemalloc.start()
+    result = func(content)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return duration, current, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=50000)
+    options = parser.parse_args()
+    content = make_payload(options.tasks)
+    print(f"{options.tasks}个任务，响应{len(content) / 1e6:.1f}MB")
+    for name, func in (
+        ("dict", use_dicts),
+        ("model", use_models),
+        ("stream", use_stream),
+        ("diff", lambda x: use_stream(x, keep=False)),
+    ):
+        duration, current, peak = measure(func, content)
+        print(
+            f"{name:<6}耗时{duration:>7.2f}s 常驻{current / 1e6:>7.1f}MB "
+            f"峰值{peak / 1e6:>7.1f}MB"
+        )
@@ -0,0 +1,72 @@
+"""NotionPyRenderer在大笔记上的耗时，渲染每行耗时基本不变说明是线性的
+
+    python script/bench_renderer.py --sizes 1250,2500,5000,10000
+"""
+import argparse
+import gc
+import time
+
+import mistletoe
+
+from todo2notion.notion_renderer import NotionPyRenderer
+
+
+def make_log(lines):
+    """一个很长的段落，每行之间是软换行"""
+    return "\n".join(
+        f"2024-01-01 00:00:{i % 60:02d} INFO worker-{i % 8} handled **request** {i}"
+        for i in range(lines)
+    )
+
+
+def make_checklist(lines):
+    return "\n".join(
+        f"- [{'x' if i % 3 == 0 else ' '}] item {i} with `code` and [link](https://example.com/{i})"
+        for i in range(lines)
+    )
+
+
+def make_code(lines):
+    """很多小代码块，每个代码块都要查找一次语言"""
+    languages = ["python", "JS", "yaml", "shell", "c++", "go", "sql", "unknown"]
+    return "\n".join(
+        f"```{languages[i % len(languages)]}\nprint({i})\n```"
+        for i in range(lines // 3)
+    )
+
+
+CORPUS = {"log": make_log, "checklist": make_checklist, "code": make_code}
+
+
+def bench(content, repeat):
+    """返回mistletoe解析和渲染各自的最短耗时"""
+    best_parse = best_render = float("inf")
+    for _ in range(repeat):
+        with NotionPyRenderer() as renderer:
+            start = time.perf_counter()
+            document = mistletoe.Document(content)
+            # 解析出来的token很多，关掉gc避免分代回收的开销掩盖渲染本身的复杂度
+            gc.disable()
+            parsed = time.perf_counter()
+            blocks = renderer.render(document)
+            rendered = time.perf_counter()
+            gc.enable()
+        best_parse = min(best_parse, parsed - start)
+        best_render = min(best_render, rendered - parsed)
+    return best_parse, best_render, len(blocks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1250,2500,5000,10000")
+    parser.add_argument("--repeat", type=int, default=3)
+    options = parser.parse_args()
+    sizes = [int(x) for x in options.sizes.split(",")]
+    for name, make in CORPUS.items():
+        for size in sizes:
+            parse, render, blocks = bench(make(size), options.repeat)
+            print(
+                f"{name:<10}{size:>7}行 解析{parse * 1000:>9.1f}ms "
+                f"渲染{render * 1000:>9.1f}ms {render / size * 1e6:>7.1f}us/行 "
+                f"{blocks:>7} blocks"
+            )
@@ -0,0 +1,56 @@
+"""检查入口模块的import耗时是否在预算内
+
+    python script/bench_startup.py --budget 100
+
+用 `python -X importtime` 多次import入口模块，取中位数和预算比较，超出预算时
+返回非0，同时打印最耗时的几个模块。
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+MODULES = ["todo2notion.todo", "todo2notion.update_heatmap"]
+
+
+def import_time(module):
+    """返回(模块累计耗时, 所有模块的累计耗时)，单位毫秒"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative_us, name = line[len("import time:") :].split("|")
+        name = name.strip()
+        if name == "site":
+            # site之前的都是解释器启动时加载的模块
+            cumulative = {}
+        elif cumulative_us.strip().isdigit():
+            cumulative[name] = int(cumulative_us) / 1000
+    return cumulative[module], cumulative
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget", type=float, default=100, help="预算（毫秒）")
+    parser.add_argument("--runs", type=int, default=5)
+    options = parser.parse_args()
+    failed = False
+    for module in MODULES:
+        times = []
+        for _ in range(options.runs):
+            total, cumulative = import_time(module)
+            times.append(total)
+        median = statistics.median(times)
+        ok = median <= options.budget
+        failed = failed or not ok
+        print(f"{module}: {median:.1f}ms (预算{options.budget:.0f}ms) {'OK' if ok else '超出预算'}")
+        top = sorted(cumulative.items(), key=lambda x: x[1], reverse=True)[1:6]
+        for name, ms in top:
+            print(f"    {name}: {ms:.1f}ms")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,60 @@
+"""宽表格和长表格的转换耗时以及需要的append请求数
+
+    python script/bench_tables.py
+
+表格的行和表格一起创建，不超过100行的表格只需要一次append请求。
+"""
+import time
+
+from todo2notion import todo
+from todo2notion.notion_renderer import iter_markdown_blocks
+
+# (名称, 列数, 行数)
+FIXTURES = [
+    ("small", 3, 10),
+    ("wide", 60, 20),
+    ("tall", 4, 100),
+    ("taller", 4, 1000),
+    ("wide-tall", 30, 500),
+]
+
+
+def make_table(columns, rows):
+    header = "| " + " | ".join(f"col {c}" for c in range(columns)) + " |"
+    separator = "|" + "---|" * columns
+    lines = [header, separator]
+    for r in range(rows):
+        lines.append(
+            "| " + " | ".join(f"**r{r}** c{c}" for c in range(columns)) + " |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+class CountingHelper:
+    """代替NotionHelper，只记录append请求"""
+
+    def __init__(self):
+        self.requests = 0
+
+    def append_blocks(self, block_id, children):
+        self.requests += 1
+        return {"results": [{"id": f"{block_id}/{i}"} for i in range(len(children))]}
+
+
+if __name__ == "__main__":
+    for name, columns, rows in FIXTURES:
+        content = make_table(columns, rows)
+        start = time.perf_counter()
+        blocks = list(iter_markdown_blocks(content))
+        render = time.perf_counter() - start
+        helper = CountingHelper()
+        todo.notion_helper = helper
+        start = time.perf_counter()
+        todo.append_block("page", blocks)
+        upload = time.perf_counter() - start
+        table = blocks[0]["table"]
+        print(
+            f"{name:<10}{columns:>4}列{rows:>6}行 渲染{render * 1000:>8.1f}ms "
+            f"准备上传{upload * 1000:>7.1f}ms append请求{helper.requests:>3}次 "
+            f"table_width={table['table_width']}"
+        )
@@ -0,0 +1,55 @@
+"""本地模拟Notion和滴答清单的webhook通知
+
+先启动 `todo daemon --port 8080 --webhook`，然后：
+
+    python script/webhook_standin.py notion <笔记或任务页面id>
+    python script/webhook_standin.py dida <滴答清单任务id> [<任务id> ...]
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import time
+import uuid
+
+import requests
+
+
+def post_notion(url, page_id, secret=None):
+    body = json.dumps(
+        {
+            "id": str(uuid.uuid4()),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+            "type": "page.content_updated",
+            "entity": {"id": page_id, "type": "page"},
+            "data": {},
+        }
+    ).encode("utf-8")
+    headers = {"content-type": "application/json"}
+    if secret:
+        signature = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+        headers["X-Notion-Signature"] = f"sha256={signature}"
+    return requests.post(f"{url}/webhook/notion", data=body, headers=headers)
+
+
+def post_dida(url, task_ids, token=None):
+    headers = {"X-Webhook-Token": token} if token else {}
+    return requests.post(
+        f"{url}/webhook/dida", json={"taskIds": task_ids}, headers=headers
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", choices=["notion", "dida"])
+    parser.add_argument("ids", nargs="+")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    options = parser.parse_args()
+    if options.source == "notion":
+        for id in options.ids:
+            r = post_notion(options.url, id, os.getenv("NOTION_WEBHOOK_SECRET"))
+            print(r.status_code, r.text)
+    else:
+        r = post_dida(options.url, options.ids, os.getenv("DIDA_WEBHOOK_TOKEN"))
+        print(r.status_code, r.text)
@@ -1,4 +1,4 @@
-from todo2notion import main
+from todo2notion.todo import main
 
 if __name__ == "__main__":
     main()
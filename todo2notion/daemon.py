@@ -0,0 +1,254 @@
+import json
+import random
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from todo2notion import todo, transport, utils
+from todo2notion.webhook import WebhookReceiver, normalize_id
+
+
+class Daemon:
+    """常驻进程，定时增量同步滴答清单到Notion
+
+    NotionHelper的缓存、requests的session以及Notion中已有的清单和任务在
+    多次同步之间保持在内存中，每次只拉取检查点之后变化的任务。
+    开启webhook后，Notion和滴答清单的变更通知会立即触发受影响任务的同步。
+    接口默认只监听127.0.0.1，监听其他地址并开启webhook时必须配置
+    NOTION_WEBHOOK_SECRET和DIDA_WEBHOOK_TOKEN，否则任何人都可以触发同步。
+    """
+
+    def __init__(
+        self,
+        session,
+        interval,
+        jitter=0,
+        port=0,
+        full_sync_every=12,
+        webhook=False,
+        host="127.0.0.1",
+    ):
+        self.session = session
+        self.interval = interval
+        self.jitter = jitter
+        self.port = port
+        self.host = host
+        # 增量同步感知不到Notion侧的修改，每隔几轮做一次全量同步，0表示只在启动时做
+        if full_sync_every < 0:
+            raise ValueError(f"DAEMON_FULL_SYNC_EVERY不能小于0: {full_sync_every}")
+        self.full_sync_every = full_sync_every
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.receiver = WebhookReceiver(self.wake_event) if webhook else None
+        if self.receiver and not is_loopback(host) and not self.receiver.is_protected():
+            raise ValueError(
+                f"webhook监听{host}时必须设置NOTION_WEBHOOK_SECRET和DIDA_WEBHOOK_TOKEN，"
+                "获取Notion的verification_token时请监听127.0.0.1并通过反向代理转发"
+            )
+        self.lock = threading.Lock()
+        self.project_dict = None
+        self.todo_dict = None
+        # 最近一次从滴答清单获取到的任务，webhook触发同步时使用
+        self.tasks = {}
+        self.check_point = 0
+        self.metrics = {
+            "status": "starting",
+            "started_at": time.time(),
+            "runs": 0,
+            "polls": 0,
+            "webhook_runs": 0,
+            "failures": 0,
+            "last_run_at": None,
+            "last_success_at": None,
+            "last_duration": None,
+            "last_error": None,
+            "last_synced_tasks": 0,
+            "synced_tasks": 0,
+            "check_point": 0,
+        }
+
+    def stop(self, signum=None, frame=None):
+        print(f"收到信号{signum}，当前同步结束后退出")
+        with self.lock:
+            self.metrics["status"] = "stopping"
+        self.stop_event.set()
+        self.wake_event.set()
+        # 正在进行的同步不再开始新的任务，剩下的任务保存到下次同步
+        todo.stop_event.set()
+
+    def run_once(self):
+        """轮询滴答清单，检查点之后变化的任务会被同步"""
+        with self.lock:
+            polls = self.metrics["polls"]
+            full = polls == 0 or (
+                self.full_sync_every > 0 and polls % self.full_sync_every == 0
+            )
+            self.metrics["polls"] += 1
+        if full or self.project_dict is None or self.todo_dict is None:
+            self.project_dict = todo.get_project_dict()
+            self.todo_dict = todo.get_todo_dict()
+            self.check_point = 0
+            self.tasks = {}
+        # 笔记的修改由webhook通知，轮询时不用再逐个检查笔记
+        tasks, self.check_point = todo.sync(
+            self.session,
+            self.project_dict,
+            self.todo_dict,
+            self.check_point,
+            check_notes=self.receiver is None or full,
+        )
+        for task in tasks:
+            self.tasks[task.id] = task
+        with self.lock:
+            self.metrics["check_point"] = self.check_point
+        return len(tasks)
+
+    def run_pending(self):
+        """同步webhook通知的任务"""
+        page_ids, task_ids = self.receiver.drain()
+        count = 0
+        if task_ids:
+            # 滴答清单的增量接口会返回这些任务以及其他同时发生的修改
+            count += self.run_once()
+        items = [
+            self.tasks.get(id)
+            for id in self.get_task_ids_by_page_ids(page_ids)
+            if id in self.tasks
+        ]
+        if items:
+            todo.add_task_to_notion(
+                items, self.project_dict, self.todo_dict, self.session
+            )
+            count += len(items)
+        with self.lock:
+            self.metrics["webhook_runs"] += 1
+        return count
+
+    def get_task_ids_by_page_ids(self, page_ids):
+        """根据任务页面或笔记页面的id找到对应的滴答清单任务id"""
+        task_ids = set()
+        if not page_ids or self.todo_dict is None:
+            return task_ids
+        for id, page in list(self.todo_dict.items()):
+            if normalize_id(page.get("id")) in page_ids:
+                # 任务页面本身被修改（比如关联了新的笔记），重新获取最新属性
+                self.todo_dict[id] = todo.notion_helper.client.pages.retrieve(
+                    page.get("id")
+                )
+                task_ids.add(id)
+                continue
+            notes = utils.get_property_value(page.get("properties").get("笔记"))
+            if notes and any(normalize_id(x.get("id")) in page_ids for x in notes):
+                task_ids.add(id)
+        return task_ids
+
+    def run_guarded(self, func):
+        start_time = time.time()
+        with self.lock:
+            self.metrics["last_run_at"] = start_time
+        try:
+            count = func()
+            with self.lock:
+                self.metrics["last_success_at"] = time.time()
+                self.metrics["last_duration"] = time.time() - start_time
+                self.metrics["last_synced_tasks"] = count
+                self.metrics["synced_tasks"] += count
+        except Exception as e:
+            print(f"同步失败: {e}")
+            with self.lock:
+                self.metrics["failures"] += 1
+                self.metrics["last_error"] = str(e)
+        finally:
+            todo.sync_state.save()
+            todo.journal.compact()
+            transport.save_governors()
+            with self.lock:
+                self.metrics["runs"] += 1
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        server = self.start_server() if self.port else None
+        todo.sync_state.load()
+        self.run_guarded(todo.replay_journal)
+        with self.lock:
+            self.metrics["status"] = "running"
+        next_poll_at = 0
+        while not self.stop_event.is_set():
+            if time.time() >= next_poll_at:
+                self.run_guarded(self.run_once)
+                wait = self.interval + random.uniform(0, self.jitter)
+                next_poll_at = time.time() + wait
+                print(f"{wait:.0f}秒后进行下一次同步")
+            elif self.receiver and self.receiver.has_pending():
+                self.run_guarded(self.run_pending)
+            if self.receiver and self.receiver.has_pending():
+                continue
+            self.wake_event.wait(max(0, next_poll_at - time.time()))
+            self.wake_event.clear()
+        if server:
+            server.shutdown()
+        print("daemon已退出")
+
+    def is_healthy(self):
+        with self.lock:
+            last_success_at = self.metrics["last_success_at"]
+            started_at = self.metrics["started_at"]
+        # 超过三个轮询周期没有成功同步就认为不健康
+        threshold = 3 * (self.interval + self.jitter)
+        return time.time() - (last_success_at or started_at) < threshold
+
+    def get_metrics(self):
+        with self.lock:
+            metrics = dict(self.metrics)
+        metrics["uptime"] = time.time() - metrics["started_at"]
+        metrics["notion"] = {x.workspace: x.stats() for x in transport.get_governors()}
+        return metrics
+
+    def start_server(self):
+        daemon = self
+        routes = {}
+        if self.receiver:
+            routes["/webhook/notion"] = self.receiver.handle_notion
+            routes["/webhook/dida"] = self.receiver.handle_dida
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/health":
+                    healthy = daemon.is_healthy()
+                    self.send_json(
+                        200 if healthy else 503, {"healthy": healthy}
+                    )
+                elif self.path == "/metrics":
+                    self.send_json(200, daemon.get_metrics())
+                else:
+                    self.send_json(404, {"error": "not found"})
+
+            def do_POST(self):
+                handler = routes.get(self.path)
+                if handler is None:
+                    self.send_json(404, {"error": "not found"})
+                    return
+                length = int(self.headers.get("content-length") or 0)
+                self.send_json(*handler(self.rfile.read(length), self.headers))
+
+            def send_json(self, code, body):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((self.host, self.port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"health/metrics接口已启动，地址{self.host}:{self.port}")
+        return server
+
+
+def is_loopback(host):
+    return host in ("localhost", "::1") or host.startswith("127.")
@@ -0,0 +1,102 @@
+import threading
+from datetime import datetime, timedelta
+
+from todo2notion.notion_helper import TARGET_ICON_URL
+from todo2notion.utils import (
+    format_date,
+    get_date,
+    get_first_and_last_day_of_month,
+    get_first_and_last_day_of_week,
+    get_first_and_last_day_of_year,
+    get_relation,
+    timestamp_to_date,
+)
+
+CHINESE_WEEKDAYS = [
+    "星期一",
+    "星期二",
+    "星期三",
+    "星期四",
+    "星期五",
+    "星期六",
+    "星期日",
+]
+
+
+def get_day_row(day):
+    """计算一天对应的星期、日、周、月、年的标题以及周月年的起止日期"""
+    date = datetime(day.year, day.month, day.day)
+    year, week, _ = day.isocalendar()
+    return {
+        "星期": CHINESE_WEEKDAYS[day.weekday()],
+        "日": (date.strftime("%Y年%m月%d日"), date, None),
+        "周": (f"{year}年第{week}周",) + get_first_and_last_day_of_week(date),
+        "月": (f"{day.year}年{day.month}月",) + get_first_and_last_day_of_month(date),
+        "年": (str(day.year),) + get_first_and_last_day_of_year(date),
+    }
+
+
+class DateDimension:
+    """日期维度表
+
+    一次同步中任务日期范围内的每一天都预先算好星期、周、月、年的标题，
+    对应的Notion页面id在第一次用到时获取并缓存，之后每个任务只需要查一次表。
+    """
+
+    def __init__(self, notion_helper):
+        self.notion_helper = notion_helper
+        self.lock = threading.Lock()
+        self.rows = {}
+        self.relation_ids = {}
+
+    def prepare(self, timestamps):
+        """预先计算这些时间戳所在日期范围内每一天的维度"""
+        days = [timestamp_to_date(x).date() for x in timestamps if x]
+        if not days:
+            return
+        day, last = min(days), max(days)
+        rows = {}
+        while day <= last:
+            if day not in self.rows:
+                rows[day] = get_day_row(day)
+            day += timedelta(days=1)
+        with self.lock:
+            self.rows.update(rows)
+
+    def get_row(self, timestamp):
+        day = timestamp_to_date(timestamp).date()
+        row = self.rows.get(day)
+        if row is None:
+            row = get_day_row(day)
+            with self.lock:
+                self.rows[day] = row
+        return row
+
+    def get_database_id(self, name):
+        return {
+            "日": self.notion_helper.day_database_id,
+            "周": self.notion_helper.week_database_id,
+            "月": self.notion_helper.month_database_id,
+            "年": self.notion_helper.year_database_id,
+        }.get(name)
+
+    def get_relation_id(self, name, value):
+        title, start, end = value
+        key = (name, title)
+        if key not in self.relation_ids:
+            properties = {
+                "日期": get_date(format_date(start), format_date(end) if end else None)
+            }
+            self.relation_ids[key] = self.notion_helper.get_relation_id(
+                title, self.get_database_id(name), TARGET_ICON_URL, properties
+            )
+        return self.relation_ids[key]
+
+    def get_weekday(self, timestamp):
+        return self.get_row(timestamp).get("星期")
+
+    def get_date_relation(self, properties, timestamp):
+        """和NotionHelper.get_date_relation一样设置年、月、周、日的关联"""
+        row = self.get_row(timestamp)
+        for name in ("年", "月", "周", "日"):
+            properties[name] = get_relation([self.get_relation_id(name, row[name])])
@@ -0,0 +1,75 @@
+from todo2notion import utils
+
+
+def get_duplicates(pages, name, keep_newest=False):
+    """按照属性name分组，返回[(保留的页面, [重复的页面])]"""
+    groups = {}
+    for page in pages:
+        value = utils.get_property_value(page.get("properties").get(name))
+        if value:
+            groups.setdefault(value, []).append(page)
+    result = []
+    for group in groups.values():
+        if len(group) > 1:
+            group.sort(key=lambda x: x.get("created_time"), reverse=keep_newest)
+            result.append((group[0], group[1:]))
+    return result
+
+
+def merge_relations(page, merged):
+    """把页面中指向重复页面的关联改为指向保留的页面，返回需要更新的属性"""
+    properties = {}
+    for key, value in page.get("properties").items():
+        if value.get("type") != "relation":
+            continue
+        ids = [x.get("id") for x in value.get("relation")]
+        new_ids = list(dict.fromkeys(merged.get(x, x) for x in ids))
+        if new_ids != ids:
+            properties[key] = utils.get_relation(new_ids)
+    return properties
+
+
+def dedup(notion_helper, dry_run=False):
+    """清理重复的页面
+
+    任务保留最新创建的页面，其他database保留最早创建的页面，
+    任务中指向重复页面的关联改为指向保留的页面之后再删除重复的页面。
+    """
+    databases = [
+        ("任务", notion_helper.todo_database_id, "id", True),
+        ("清单", notion_helper.project_database_id, "id", False),
+        ("标签", notion_helper.tag_database_id, "标题", False),
+        ("日", notion_helper.day_database_id, "标题", False),
+        ("周", notion_helper.week_database_id, "标题", False),
+        ("月", notion_helper.month_database_id, "标题", False),
+        ("年", notion_helper.year_database_id, "标题", False),
+        ("全部", notion_helper.all_database_id, "标题", False),
+    ]
+    merged = {}
+    todos = []
+    for title, database_id, name, keep_newest in databases:
+        if not database_id:
+            continue
+        pages = notion_helper.query_all(database_id)
+        if database_id == notion_helper.todo_database_id:
+            todos = pages
+        duplicates = get_duplicates(pages, name, keep_newest)
+        for keep, pages in duplicates:
+            for page in pages:
+                merged[page.get("id")] = keep.get("id")
+        print(f"{title}: {len(duplicates)}组重复，{sum(len(x) for _, x in duplicates)}个页面需要删除")
+    if dry_run or not merged:
+        return merged
+    updated = 0
+    for page in todos:
+        if page.get("id") in merged:
+            continue
+        properties = merge_relations(page, merged)
+        if properties:
+            notion_helper.update_book_page(page.get("id"), properties)
+            updated += 1
+    print(f"更新了{updated}个任务的关联")
+    for id in merged:
+        notion_helper.delete_block(id)
+    print(f"删除了{len(merged)}个重复的页面")
+    return merged
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from todo2notion.state import STATE_DIR
+
+# 初始速率（每秒请求数），Notion文档中的平均限制是每秒3个请求
+RATE = float(os.getenv("NOTION_RATE", 3))
+MIN_RATE = float(os.getenv("NOTION_MIN_RATE", 0.5))
+MAX_RATE = float(os.getenv("NOTION_MAX_RATE", 10))
+# 平均延迟超过这个值（秒）就不再提高速率
+TARGET_LATENCY = float(os.getenv("NOTION_TARGET_LATENCY", 3))
+
+
+def get_workspace_key(token):
+    """不保存token本身，用token的hash区分不同的工作区"""
+    return hashlib.sha256((token or "").encode("utf-8")).hexdigest()[:16]
+
+
+def parse_retry_after(value):
+    """Retry-After可能是秒数，也可能是HTTP日期"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Governor:
+    """AIMD自适应限流
+
+    请求按照rate匀速发出，请求成功并且平均延迟低于TARGET_LATENCY时速率线性增加，
+    收到429时速率减半，有Retry-After的话所有请求都暂停到指定时间之后。
+    学到的速率按工作区保存在本地，下次运行从这个速率开始。
+    """
+
+    def __init__(self, workspace, path=None, increase=0.2, decrease=0.5):
+        self.workspace = workspace
+        self.path = path or os.path.join(STATE_DIR, "governor.json")
+        self.increase = increase
+        self.decrease = decrease
+        self.condition = threading.Condition()
+        self.rate = RATE
+        self.next_at = 0
+        self.paused_until = 0
+        self.decreased_at = 0
+        self.latency = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.throttled = 0
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                rate = json.load(f).get(self.workspace, {}).get("rate")
+            if rate:
+                self.rate = min(MAX_RATE, max(MIN_RATE, rate))
+        return self
+
+    def save(self):
+        data = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        with self.condition:
+            data[self.workspace] = {"rate": self.rate, "updated_at": time.time()}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def acquire(self):
+        """等待到可以发出下一个请求"""
+        with self.condition:
+            self.waiting += 1
+            while True:
+                now = time.monotonic()
+                wait = max(self.paused_until, self.next_at) - now
+                if wait <= 0:
+                    break
+                self.condition.wait(wait)
+            self.waiting -= 1
+            self.next_at = now + 1 / self.rate
+            self.in_flight += 1
+
+    def release(self, latency, status, retry_after=None):
+        with self.condition:
+            self.in_flight -= 1
+            self.requests += 1
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency = 0.8 * self.latency + 0.2 * latency
+            now = time.monotonic()
+            if status == 429:
+                self.throttled += 1
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+                # 同一时间发出的请求会一起收到429，一秒内只减一次
+                if now - self.decreased_at >= 1:
+                    self.rate = max(MIN_RATE, self.rate * self.decrease)
+                    self.decreased_at = now
+            elif 200 <= status < 500 and self.latency <= TARGET_LATENCY:
+                # 每秒大约增加increase
+                self.rate = min(MAX_RATE, self.rate + self.increase / self.rate)
+
+    def stats(self):
+        with self.condition:
+            return {
+                "rate": round(self.rate, 2),
+                "latency": round(self.latency or 0, 3),
+                "in_flight": self.in_flight,
+                "queue_depth": self.waiting,
+                "requests": self.requests,
+                "throttled": self.throttled,
+            }
+
+    def report(self):
+        stats = self.stats()
+        return (
+            f"Notion请求{stats['requests']}次，429 {stats['throttled']}次，"
+            f"当前速率{stats['rate']}次/秒，平均延迟{stats['latency']}秒，"
+            f"排队{stats['queue_depth']}个"
+        )
+
+
+class GovernedTransport(httpx.BaseTransport):
+    """经过Governor限流的httpx transport，429按照Retry-After等待后重试"""
+
+    def __init__(self, transport, governor, max_retries=5):
+        self.transport = transport
+        self.governor = governor
+        self.max_retries = max_retries
+
+    def handle_request(self, request):
+        for attempt in range(self.max_retries + 1):
+            self.governor.acquire()
+            start_time = time.monotonic()
+            try:
+                response = self.transport.handle_request(request)
+            except Exception:
+                self.governor.release(time.monotonic() - start_time, 0)
+                raise
+            retry_after = parse_retry_after(response.headers.get("retry-after"))
+            self.governor.release(
+                time.monotonic() - start_time, response.status_code, retry_after
+            )
+            if response.status_code != 429 or attempt == self.max_retries:
+                return response
+            response.read()
+            response.close()
+        return response
+
+    def close(self):
+        self.transport.close()
@@ -0,0 +1,135 @@
+import json
+import os
+import threading
+import time
+
+from todo2notion.state import STATE_DIR
+
+# 同步一个任务依次要做的操作：创建新页面、写入正文、删除旧页面
+OPERATIONS = ("create", "append", "delete")
+
+
+class Journal:
+    """同步任务的预写日志
+
+    每个任务在修改Notion之前先记下计划的操作，每完成一步追加一行记录，
+    文件按行追加写入，进程在任何时候被中断都能知道哪些操作没有完成。
+    下次启动时replay只处理没有完成的任务：正文已经写完的继续删除旧页面，
+    否则删除写了一半的新页面，旧页面保留下来等待重新同步。
+    原地更新的任务新旧页面是同一个，不会被删除。
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(STATE_DIR, "journal.jsonl")
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        record["time"] = time.time()
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def begin(self, id, old=None):
+        """记录一个任务计划要做的操作，old是要被替换的旧页面"""
+        self.write({"id": id, "op": "begin", "old": old, "ops": list(OPERATIONS)})
+
+    def done(self, id, op, **fields):
+        self.write(dict(fields, id=id, op=op, status="done"))
+
+    def load(self):
+        """返回没有完成的任务，id -> {"old", "page", "done"}"""
+        pending = {}
+        if not os.path.exists(self.path):
+            return pending
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 最后一行可能只写了一半
+                    continue
+                id = record.get("id")
+                if record.get("op") == "begin":
+                    pending[id] = {
+                        "old": record.get("old"),
+                        "page": None,
+                        "done": set(),
+                    }
+                elif id in pending:
+                    txn = pending[id]
+                    txn["done"].add(record.get("op"))
+                    txn["page"] = record.get("page") or txn["page"]
+                    if "rollback" in txn["done"] or txn["done"].issuperset(OPERATIONS):
+                        pending.pop(id)
+        return pending
+
+    def compact(self):
+        """只保留没有完成的任务的记录"""
+        pending = self.load()
+        with self.lock:
+            if not pending:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                return
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for id, txn in pending.items():
+                    records = [
+                        {"id": id, "op": "begin", "old": txn["old"], "ops": list(OPERATIONS)}
+                    ]
+                    records.extend(
+                        {"id": id, "op": op, "status": "done", "page": txn["page"]}
+                        for op in OPERATIONS
+                        if op in txn["done"]
+                    )
+                    for record in records:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+
+    def replay(self, notion_helper, on_incomplete=None):
+        """处理上次中断时没有完成的任务，重复执行也不会产生副作用
+
+        每个没有完成的任务都会调用on_incomplete(id)，页面正文的状态已经不确定。
+        """
+        # 先重写一遍日志，去掉中断时只写了一半的最后一行
+        self.compact()
+        pending = self.load()
+        if not pending:
+            return 0
+        print(f"上次同步有{len(pending)}个任务没有完成，开始恢复")
+        for id, txn in pending.items():
+            if on_incomplete:
+                on_incomplete(id)
+            if "append" in txn["done"]:
+                # 新页面已经完整写入，只差删除旧页面
+                if txn["old"] and txn["old"] != txn["page"]:
+                    self.archive(notion_helper, txn["old"])
+                self.done(id, "delete", page=txn["page"])
+                continue
+            pages = [txn["page"]] if txn["page"] else self.find_pages(notion_helper, id)
+            for page_id in pages:
+                if page_id != txn["old"]:
+                    self.archive(notion_helper, page_id)
+            self.done(id, "rollback")
+        self.compact()
+        return len(pending)
+
+    @staticmethod
+    def find_pages(notion_helper, id):
+        """创建请求可能已经成功但没来得及记录，按滴答清单的id查找"""
+        pages = notion_helper.find_pages(notion_helper.todo_database_id, ("id", id))
+        return [x.get("id") for x in pages]
+
+    @staticmethod
+    def archive(notion_helper, page_id):
+        try:
+            notion_helper.client.blocks.delete(block_id=page_id)
+        except Exception as e:
+            # 已经被删除的页面会返回错误，不影响恢复
+            print(f"删除页面{page_id}失败: {e}")
@@ -0,0 +1,143 @@
+import calendar
+import hashlib
+import json
+from datetime import datetime, timezone
+
+from todo2notion import utils
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+DIDA_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.000+0000"
+
+
+def parse_time(value):
+    """时间字符串转化为时间戳
+
+    滴答清单返回的时间格式固定是2024-01-01T00:00:00.000+0000，直接按位置取出各部分计算，
+    其他格式交给pendulum。
+    """
+    if not value:
+        return None
+    if len(value) == 28 and value[10] == "T" and value[19] == "." and value[23] in "+-":
+        try:
+            timestamp = calendar.timegm(
+                (
+                    int(value[0:4]),
+                    int(value[5:7]),
+                    int(value[8:10]),
+                    int(value[11:13]),
+                    int(value[14:16]),
+                    int(value[17:19]),
+                )
+            )
+            offset = int(value[24:26]) * 3600 + int(value[26:28]) * 60
+            return timestamp - offset if value[23] == "+" else timestamp + offset
+        except ValueError:
+            pass
+    return utils.parse_date(value)
+
+
+def format_time(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime(DIDA_TIME_FORMAT)
+
+
+class Task:
+    """滴答清单的任务或者子任务
+
+    解析一次，时间都转化为时间戳，同步过程中不再处理原始的dict。
+    """
+
+    __slots__ = (
+        "id",
+        "project_id",
+        "parent_id",
+        "title",
+        "content",
+        "tags",
+        "progress",
+        "start_date",
+        "due_date",
+        "modified_time",
+        "completed_time",
+        "items",
+        "_fingerprint",
+    )
+
+    @classmethod
+    def from_dict(cls, data):
+        task = cls.__new__(cls)
+        task.id = data.get("id")
+        task.project_id = data.get("projectId")
+        task.parent_id = data.get("parentId")
+        task.title = data.get("title")
+        task.content = data.get("content")
+        task.tags = data.get("tags")
+        task.progress = data.get("progress")
+        task.start_date = parse_time(data.get("startDate"))
+        task.due_date = parse_time(data.get("dueDate"))
+        task.modified_time = parse_time(data.get("modifiedTime"))
+        task.completed_time = parse_time(data.get("completedTime"))
+        task.items = [cls.from_dict(x) for x in data.get("items") or []]
+        task._fingerprint = data.get("fingerprint")
+        return task
+
+    @property
+    def fingerprint(self):
+        """根据会写入Notion的字段计算的指纹，子任务也计算在内
+
+        其他字段（比如sortOrder、提醒）的修改不需要同步，只在用到时计算一次。
+        """
+        if self._fingerprint is None:
+            value = [
+                self.title,
+                self.start_date,
+                self.due_date,
+                self.progress,
+                self.tags,
+                self.project_id,
+                self.content,
+                self.completed_time,
+                [x.fingerprint for x in self.items],
+            ]
+            value = json.dumps(value, ensure_ascii=False)
+            self._fingerprint = hashlib.sha1(value.encode("utf-8")).hexdigest()
+        return self._fingerprint
+
+    def to_dict(self):
+        """转化为滴答清单的格式，用于保存推迟同步的任务"""
+        return {
+            "id": self.id,
+            "projectId": self.project_id,
+            "parentId": self.parent_id,
+            "title": self.title,
+            "content": self.content,
+            "tags": self.tags,
+            "progress": self.progress,
+            "startDate": format_time(self.start_date),
+            "dueDate": format_time(self.due_date),
+            "modifiedTime": format_time(self.modified_time),
+            "completedTime": format_time(self.completed_time),
+            "items": [x.to_dict() for x in self.items],
+            "fingerprint": self.fingerprint,
+        }
+
+
+class Project:
+    """滴答清单的清单"""
+
+    __slots__ = ("id", "name", "modified_time")
+
+    @classmethod
+    def from_dict(cls, data):
+        project = cls.__new__(cls)
+        project.id = data.get("id")
+        project.name = data.get("name")
+        project.modified_time = parse_time(data.get("modifiedTime"))
+        return project
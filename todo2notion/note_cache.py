@@ -0,0 +1,134 @@
+import copy
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from todo2notion.state import STATE_DIR
+
+# 不能通过api创建的block
+UNSUPPORTED_TYPES = ("child_page", "child_database", "unsupported")
+
+
+def clean_block(block, children):
+    """api返回的block只保留创建时需要的部分，子block放在children中"""
+    type = block.get("type")
+    if type == "column_list":
+        # 分栏必须和栏一起创建，直接展开成栏里面的内容
+        return [x for column in children for x in column.get("children", [])]
+    if type == "column":
+        return [{"type": type, "children": children}]
+    payload = dict(block.get(type) or {})
+    result = {"type": type, type: payload}
+    if type == "table":
+        # 表格必须和行一起创建
+        payload["children"] = children
+    elif children:
+        result["children"] = children
+    return [result]
+
+
+class NoteCache:
+    """笔记内容的本地缓存
+
+    按笔记页面id和last_edited_time缓存完整的block树，追加写入jsonl文件，
+    同一个id以最后一行为准。没有修改的笔记直接从本地读取，修改过的笔记逐层并发获取子block。
+    Notion的last_edited_time精确到分钟，在同一分钟内获取的内容不会被当作缓存命中。
+    """
+
+    def __init__(self, notion_helper, path=None, workers=None):
+        self.notion_helper = notion_helper
+        self.path = path or os.path.join(STATE_DIR, "notes.jsonl")
+        self.workers = workers or int(os.getenv("NOTE_WORKERS", 4))
+        self.lock = threading.Lock()
+        self.notes = None
+
+    def load(self):
+        notes = {}
+        lines = 0
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    notes[entry.get("id")] = entry
+                    lines += 1
+        self.notes = notes
+        # 过期的记录比有效的多时重写一遍文件
+        if lines > 2 * len(notes):
+            self.compact()
+        return self
+
+    def compact(self):
+        with self.lock:
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for entry in self.notes.values():
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+
+    def append(self, entry):
+        with self.lock:
+            self.notes[entry.get("id")] = entry
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def get_blocks(self, id, last_edited_time):
+        """返回笔记的block树，可以直接追加到其他页面"""
+        if self.notes is None:
+            with self.lock:
+                if self.notes is None:
+                    self.load()
+        entry = self.notes.get(id)
+        if (
+            entry
+            and entry.get("last_edited_time") == last_edited_time
+            and entry.get("fetched_at", 0) >= get_timestamp(last_edited_time) + 60
+        ):
+            # 上传时会修改block，返回副本
+            return copy.deepcopy(entry.get("blocks"))
+        blocks = self.fetch(id)
+        self.append(
+            {
+                "id": id,
+                "last_edited_time": last_edited_time,
+                "fetched_at": time.time(),
+                "blocks": blocks,
+            }
+        )
+        return copy.deepcopy(blocks)
+
+    def fetch(self, id):
+        """按层并发获取所有子block"""
+        children = {}
+        level = [id]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while level:
+                results = list(executor.map(self.notion_helper.get_block_children, level))
+                children.update(zip(level, results))
+                level = [
+                    x.get("id")
+                    for blocks in results
+                    for x in blocks
+                    if x.get("has_children") and x.get("type") not in UNSUPPORTED_TYPES
+                ]
+        return self.build(id, children)
+
+    def build(self, id, children):
+        blocks = []
+        for block in children.get(id, []):
+            if block.get("type") in UNSUPPORTED_TYPES:
+                continue
+            blocks.extend(clean_block(block, self.build(block.get("id"), children)))
+        return blocks
+
+
+def get_timestamp(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
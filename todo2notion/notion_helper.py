@@ -1,12 +1,10 @@
-import io
-import logging
 import os
 import re
+import threading
 import time
+from datetime import datetime
 
-from notion_client import Client
 from retrying import retry
-from datetime import datetime, timedelta
 
 from todo2notion.utils import (
     format_date,
@@ -19,13 +17,7 @@ from todo2notion.utils import (
     get_title,
     get_property_value
 )
-from dotenv import load_dotenv
-from urllib.parse import unquote, urlparse
 
-import requests
-from notion_client import Client
-from retrying import retry
-load_dotenv()
 TAG_ICON_URL = "https://www.notion.so/icons/tag_gray.svg"
 USER_ICON_URL = "https://www.notion.so/icons/user-circle-filled_gray.svg"
 TARGET_ICON_URL = "https://www.notion.so/icons/target_red.svg"
@@ -34,11 +26,16 @@ BOOKMARK_ICON_URL = "https://www.notion.so/icons/bookmark_gray.svg"
 
 class NotionHelper:
     database_id_dict = {}
-    todo_heatmap_block_id = os.getenv("HEATMAP_BLOCK_ID")
     property_dict = {}
     def __init__(self):
-        self.client = Client(auth=os.getenv("NOTION_TOKEN"), log_level=logging.ERROR)
+        self.todo_heatmap_block_id = os.getenv("HEATMAP_BLOCK_ID")
+        from todo2notion.transport import new_notion_client
+
+        self.client = new_notion_client(os.getenv("NOTION_TOKEN"))
         self.__cache = {}
+        # 并发同步时同一个标题只能由一个线程查询或创建，避免创建出重复的页面
+        self.__lock = threading.Lock()
+        self.__key_locks = {}
         self.todo_database_id = os.getenv("TASK_DATABASE_ID")
         self.project_database_id = os.getenv("LIST_DATABASE_ID")
         self.tag_database_id = os.getenv("TAG_DATABASE_ID")
@@ -119,19 +116,36 @@ class NotionHelper:
         key = f"{id}{name}"
         if key in self.__cache:
             return self.__cache.get(key)
-        filter = {"property": "标题", "title": {"equals": name}}
-        response = self.client.databases.query(database_id=id, filter=filter)
-        if len(response.get("results")) == 0:
-            parent = {"database_id": id, "type": "database_id"}
-            properties["标题"] = get_title(name)
-            page_id = self.client.pages.create(
-                parent=parent, properties=properties, icon=get_icon(icon)
-            ).get("id")
-        else:
-            page_id = response.get("results")[0].get("id")
-        self.__cache[key] = page_id
+        with self.get_lock(key):
+            if key in self.__cache:
+                return self.__cache.get(key)
+            filter = {"property": "标题", "title": {"equals": name}}
+            response = self.client.databases.query(database_id=id, filter=filter)
+            if len(response.get("results")) == 0:
+                parent = {"database_id": id, "type": "database_id"}
+                properties = dict(properties, 标题=get_title(name))
+                page_id = self.create_page(
+                    parent=parent,
+                    properties=properties,
+                    icon=get_icon(icon),
+                    key=("标题", name),
+                ).get("id")
+            else:
+                page_id = response.get("results")[0].get("id")
+            self.__cache[key] = page_id
         return page_id
 
+    @retry(stop_max_attempt_number=3, wait_fixed=5000)
+    def get_persons(self):
+        """获取工作区中的成员，结果会被缓存"""
+        if "persons" not in self.__cache:
+            self.__cache["persons"] = [
+                x
+                for x in self.client.users.list().get("results")
+                if x.get("type") == "person"
+            ]
+        return self.__cache.get("persons")
+
     @retry(stop_max_attempt_number=3, wait_fixed=5000)
     def update_book_page(self, page_id, properties):
         return self.client.pages.update(page_id=page_id, properties=properties)
@@ -140,12 +154,64 @@ class NotionHelper:
     def update_page(self, page_id, properties,icon):
         return self.client.pages.update(page_id=page_id, properties=properties,icon=icon)
 
+    def get_lock(self, key):
+        with self.__lock:
+            return self.__key_locks.setdefault(key, threading.Lock())
+
+    def create_page(self, parent, properties, icon, key=None, exclude=None):
+        """创建页面
+
+        key是(属性, 值)，比如任务的("id", 滴答清单的id)、关联database的("标题", 标题)。
+        请求超时的时候Notion可能已经创建了页面，所以重试之前先按key查找这次创建的页面，
+        同一个key的创建是串行的。exclude是要被新页面替换掉的旧页面。
+        查找只在这一次调用的重试中进行，页面被删除之后再次调用会重新创建。
+        """
+        if key is None:
+            return self.create_page_with_retry(parent, properties, icon)
+        database_id = parent.get("database_id")
+        with self.get_lock((database_id,) + tuple(key)):
+            start_time = time.time()
+            for attempt in range(3):
+                if attempt:
+                    time.sleep(5)
+                    page = self.find_created_page(database_id, key, start_time, exclude)
+                    if page:
+                        print(f"页面已经创建过了，不再重复创建: {key[1]}")
+                        break
+                try:
+                    page = self.client.pages.create(
+                        parent=parent, properties=properties, icon=icon
+                    )
+                    break
+                except Exception as e:
+                    if attempt == 2:
+                        raise
+                    print(f"创建页面失败，准备重试: {e}")
+            return page
+
     @retry(stop_max_attempt_number=3, wait_fixed=5000)
-    def create_page(self, parent, properties, icon):
+    def create_page_with_retry(self, parent, properties, icon):
         return self.client.pages.create(
             parent=parent, properties=properties, icon=icon
         )
 
+    def find_pages(self, database_id, key):
+        """按照id或者标题查找database中的页面"""
+        name, value = key
+        type = "title" if name == "标题" else "rich_text"
+        filter = {"property": name, type: {"equals": value}}
+        return self.query_all_by_book(database_id, filter)
+
+    def find_created_page(self, database_id, key, start_time, exclude=None):
+        """查找start_time之后按key创建的页面，Notion的created_time精确到分钟"""
+        for page in self.find_pages(database_id, key):
+            created_time = datetime.fromisoformat(
+                page.get("created_time").replace("Z", "+00:00")
+            ).timestamp()
+            if page.get("id") != exclude and created_time >= start_time - 60:
+                return page
+        return None
+
     @retry(stop_max_attempt_number=3, wait_fixed=5000)
     def query(self, **kwargs):
         kwargs = {k: v for k, v in kwargs.items() if v}
@@ -173,6 +239,12 @@ class NotionHelper:
             block_id=block_id, children=children, after=after
         )
 
+    @retry(stop_max_attempt_number=3, wait_fixed=5000)
+    def update_block(self, block_id, block):
+        """用block的内容替换已有的同类型block，不包括子block"""
+        type = block.get("type")
+        return self.client.blocks.update(block_id=block_id, **{type: block.get(type)})
+
     @retry(stop_max_attempt_number=3, wait_fixed=5000)
     def delete_block(self, block_id):
         return self.client.blocks.delete(block_id=block_id)
@@ -240,3 +312,17 @@ class NotionHelper:
             ]
         )
 
+
+class LazyNotionHelper:
+    """第一次访问属性时才创建NotionHelper，import时不会创建Notion client"""
+
+    def __init__(self):
+        self._helper = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._helper is None:
+            with self._lock:
+                if self._helper is None:
+                    self._helper = NotionHelper()
+        return getattr(self._helper, name)
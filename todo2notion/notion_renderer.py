@@ -1,19 +1,99 @@
 from itertools import chain
-import random
 import re
-from collections.abc import Iterable
 from mistletoe.base_renderer import BaseRenderer
 from mistletoe.block_token import HTMLBlock, CodeFence
 from mistletoe.span_token import Image, Link, HTMLSpan, SpanToken
 from html.parser import HTMLParser
 
 
-def flatten(l):
-    for el in l:
-        if isinstance(el, Iterable) and not isinstance(el, (str, bytes, dict)):
-            yield from flatten(el)
-        else:
-            yield el
+# The code block languages Notion.so accepts, in the order they are matched
+NOTION_LANGUAGES = [
+    "ABAP",
+    "Arduino",
+    "Bash",
+    "BASIC",
+    "C",
+    "Clojure",
+    "CoffeeScript",
+    "C++",
+    "C#",
+    "CSS",
+    "Dart",
+    "Diff",
+    "Docker",
+    "Elixir",
+    "Elm",
+    "Erlang",
+    "Flow",
+    "Fortran",
+    "F#",
+    "Gherkin",
+    "GLSL",
+    "Go",
+    "GraphQL",
+    "Groovy",
+    "Haskell",
+    "HTML",
+    "Java",
+    "JavaScript",
+    "JSON",
+    "Kotlin",
+    "LaTeX",
+    "Less",
+    "Lisp",
+    "LiveScript",
+    "Lua",
+    "Makefile",
+    "Markdown",
+    "Markup",
+    "MATLAB",
+    "Nix",
+    "Objective-C",
+    "OCaml",
+    "Pascal",
+    "Perl",
+    "PHP",
+    "Plain Text",
+    "PowerShell",
+    "Prolog",
+    "Python",
+    "R",
+    "Reason",
+    "Ruby",
+    "Rust",
+    "Sass",
+    "Scala",
+    "Scheme",
+    "Scss",
+    "Shell",
+    "SQL",
+    "Swift",
+    "TypeScript",
+    "VB.Net",
+    "Verilog",
+    "VHDL",
+    "Visual Basic",
+    "WebAssembly",
+    "XML",
+    "YAML",
+]
+
+
+def buildLanguageIndex(languages):
+    """
+    Maps every lowercase prefix of a Notion language to the first language it
+    prefixes, so a code fence language is resolved with one dict lookup instead
+    of a case-insensitive regex match against every language
+    """
+    index = {}
+    for lang in languages:
+        lower = lang.lower()
+        for end in range(1, len(lower) + 1):
+            index.setdefault(lower[:end], lang)
+    return index
+
+
+NOTION_LANGUAGE_INDEX = buildLanguageIndex(NOTION_LANGUAGES)
 
 
 def addHtmlImgTagExtension(notionPyRendererCls):
@@ -49,8 +129,8 @@ class NotionPyRenderer(BaseRenderer):
     with notion-py. Each object will have a .type for the block type and then
     a bunch of different dict entries corresponding to kwargs for that block
     type.
-    For CollectionViewBlocks, a .rows entry exists in the dictionary with a list
-    object containing a descriptor for every row. This is still TODO
+    Tables are rendered as Notion API table blocks with their table_row blocks
+    inlined under table.children.
     """
 
     def __init__(self, *extraExtensions):
@@ -72,9 +152,18 @@ class NotionPyRenderer(BaseRenderer):
 
     def renderMultiple(self, tokens):
         """
-        Takes an array of sibling tokens and renders each one out.
+        Takes an array of sibling tokens and renders each one out. Render methods
+        return either a single block or an already flat list of blocks, so the
+        result is built with a single append-only pass
         """
-        return list(flatten(self.render(t) for t in tokens))
+        blocks = []
+        for t in tokens:
+            rendered = self.render(t)
+            if isinstance(rendered, list):
+                blocks.extend(rendered)
+            else:
+                blocks.append(rendered)
+        return blocks
 
     def renderMultipleToString(self, tokens):
         """
@@ -95,99 +184,31 @@ class NotionPyRenderer(BaseRenderer):
         @param {function} toBlockFunc Takes a str and returns a dict for the created
         @returns {dict[]}
         """
-        blocks = self.renderMultipleToString(tokens)
-        ret = []
-        for block in blocks:
-            ret = ret + [toBlockFunc(block)]
-        return ret
+        return [toBlockFunc(block) for block in self.renderMultipleToString(tokens)]
 
     def render_document(self, token):
         return self.renderMultiple(token.children)
 
+    def iterDocument(self, token):
+        """
+        Like render_document but yields the top-level blocks one at a time as
+        each child of the document is rendered, so callers can start uploading
+        before the whole document is converted
+        """
+        for child in token.children:
+            rendered = self.render(child)
+            if isinstance(rendered, list):
+                yield from rendered
+            else:
+                yield rendered
+
     # == MD Block Tokens ==
     def render_block_code(self, token):
         # Indented code and ``` ``` code fence
         # Notion seems really picky about the language field and the case sensitivity
         # so we match the string to the specific version that Notion.so expects
-        notionSoLangs = [
-            "ABAP",
-            "Arduino",
-            "Bash",
-            "BASIC",
-            "C",
-            "Clojure",
-            "CoffeeScript",
-            "C++",
-            "C#",
-            "CSS",
-            "Dart",
-            "Diff",
-            "Docker",
-            "Elixir",
-            "Elm",
-            "Erlang",
-            "Flow",
-            "Fortran",
-            "F#",
-            "Gherkin",
-            "GLSL",
-            "Go",
-            "GraphQL",
-            "Groovy",
-            "Haskell",
-            "HTML",
-            "Java",
-            "JavaScript",
-            "JSON",
-            "Kotlin",
-            "LaTeX",
-            "Less",
-            "Lisp",
-            "LiveScript",
-            "Lua",
-            "Makefile",
-            "Markdown",
-            "Markup",
-            "MATLAB",
-            "Nix",
-            "Objective-C",
-            "OCaml",
-            "Pascal",
-            "Perl",
-            "PHP",
-            "Plain Text",
-            "PowerShell",
-            "Prolog",
-            "Python",
-            "R",
-            "Reason",
-            "Ruby",
-            "Rust",
-            "Sass",
-            "Scala",
-            "Scheme",
-            "Scss",
-            "Shell",
-            "SQL",
-            "Swift",
-            "TypeScript",
-            "VB.Net",
-            "Verilog",
-            "VHDL",
-            "Visual Basic",
-            "WebAssembly",
-            "XML",
-            "YAML",
-        ]
         if token.language != "":
-            matchLang = next(
-                (
-                    lang
-                    for lang in notionSoLangs
-                    if re.match(re.escape(token.language), lang, re.I)
-                ),
-                "",
-            )
+            matchLang = NOTION_LANGUAGE_INDEX.get(token.language.lower(), "")
             if not matchLang:
                 print(
                     f"Code block language {token.language} has no corresponding syntax in Notion.so"
@@ -291,62 +312,43 @@ class NotionPyRenderer(BaseRenderer):
         return result
 
     def render_table(self, token):
-        headerRow = self.render(token.header)  # Header is a single row
-        rows = [
-            self.render(r) for r in token.children
-        ]  # don't use renderMultiple because it flattens
-
-        def randColId():
-            def randChr():
-                # ASCII 32 - 126 is ' ' to '~', all printable characters
-                return chr(random.randrange(32, 126))
-
-            # 4 characters long of random printable characters, I don't think it
-            # has any correlation to the data?
-            return "".join([randChr() for c in range(4)])
-
-        def textColSchema(colName):
-            return {"name": colName, "type": "text"}
-
-        # The schema is basically special identifiers + the type of property
-        # to put into Notion. Coming from Markdown, everything is going to
-        # be text.
-        # 'J=}x': {
-        #     'name': 'Column',
-        #     'type': 'text'
-        # },
-        schema = {
-            randColId(): textColSchema(headerRow[r]) for r in range(len(headerRow) - 1)
-        }
-        # The last one needs to be named 'Title' and is type title
-        # 'title': {
-        #     'name': 'Name',
-        #     'type': 'title'
-        # }
-        schema.update({"title": {"name": headerRow[-1], "type": "title"}})
-
-        # CollectionViewBlock, and it's gonna be a bit hard to do because this
-        # isn't fully fleshed out in notion-py yet but we can still use create_record
+        # Rendered as a Notion API table block with the rows inlined as children
+        # so the whole table is created by a single append call
+        rows = [self.render(token.header)] if hasattr(token, "header") else []
+        rows.extend(self.render(r) for r in token.children)
+        width = len(rows[0]["table_row"]["cells"]) if rows else 0
+        for row in rows:
+            # Notion requires every row to have exactly table_width cells
+            cells = row["table_row"]["cells"][:width]
+            cells.extend([] for _ in range(width - len(cells)))
+            row["table_row"]["cells"] = cells
         return {
-            "type": CollectionViewBlock,
-            "rows": rows,  # everything except the initial row
-            "schema": schema,
+            "type": "table",
+            "table": {
+                "table_width": width,
+                "has_column_header": hasattr(token, "header"),
+                "has_row_header": False,
+                "children": rows,
+            },
         }
 
     def render_table_row(self, token):
-        # Rows are a concept in Notion (`CollectionRowBlock`) but notion-py provides
-        # another API to use it, `.add_row()` so we just render down to an array
-        # and handle in the Table block.
-        return self.renderMultiple(token.children)
+        return {
+            "type": "table_row",
+            "table_row": {"cells": [self.render(c) for c in token.children]},
+        }
 
     def render_table_cell(self, token):
-        # Render straight down to a string, cells aren't a concept in Notion
-        strs, blocks = self.renderMultipleToString(token.children)
-        if blocks:
-            print(
-                "Table cell contained non-strings (maybe an image?) and could not add..."
-            )
-        return strs
+        # A cell is a rich text array, anything that is not text can't be added
+        rich_text = []
+        for item in self.renderMultiple(token.children):
+            if isinstance(item, dict) and item.get("type") == "text":
+                rich_text.append(item)
+            elif item is not None:
+                print(
+                    "Table cell contained non-strings (maybe an image?) and could not add..."
+                )
+        return rich_text
 
     # == MD Span Tokens ==
     # These tokens always appear inside another block-level token (so we can return
@@ -492,3 +494,16 @@ class InlineEquation(SpanToken):
 
 class BlockEquation(CodeFence):
     pattern = re.compile(r"( {0,3})((?:\$){2,}) *(\S*)")
+
+
+def iter_markdown_blocks(content):
+    """Parses Markdown and yields the Notion blocks of the document one by one"""
+    import mistletoe
+
+    with NotionPyRenderer() as renderer:
+        yield from renderer.iterDocument(mistletoe.Document(content))
+
+
+def render_markdown_blocks(content):
+    """Parses Markdown into a list of Notion blocks; picklable so it can run in a process pool"""
+    return list(iter_markdown_blocks(content))
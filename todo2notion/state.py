@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+STATE_DIR = os.getenv("STATE_DIR", "state")
+# 热力图按照北京时间统计每天完成的任务
+TZ_OFFSET = timezone(timedelta(hours=8))
+
+
+def get_day(timestamp):
+    """时间戳转化为北京时间的日期字符串"""
+    return datetime.fromtimestamp(timestamp, TZ_OFFSET).strftime("%Y-%m-%d")
+
+
+class SyncState:
+    """本地保存的同步状态
+
+    tasks记录每个已同步任务的信息，heatmap是按天汇总的完成任务数，
+    任务完成时间变化时只更新受影响的日期。pending是被推迟到下次同步的任务。
+    seeded表示已经从Notion读取过所有任务，同步只会记录重新写入的任务，
+    没有读取过时热力图缺少之前完成的任务。
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(STATE_DIR, "todo.json")
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.heatmap = {}
+        self.pending = []
+        self.seeded = False
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.tasks = data.get("tasks", {})
+            self.heatmap = data.get("heatmap", {})
+            self.pending = data.get("pending", [])
+            self.seeded = data.get("seeded", False)
+        return self
+
+    def save(self):
+        with self.lock:
+            data = {
+                "tasks": self.tasks,
+                "heatmap": self.heatmap,
+                "pending": self.pending,
+                "seeded": self.seeded,
+            }
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # 先写临时文件再替换，进程中断时不会留下损坏的状态文件
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, sort_keys=True)
+            os.replace(tmp, self.path)
+
+    def get_task(self, id):
+        return self.tasks.get(id)
+
+    def update_task(self, id, **fields):
+        """更新任务的记录，completed_time变化时同步更新热力图"""
+        with self.lock:
+            task = self.tasks.setdefault(id, {})
+            if "completed_time" in fields:
+                self._move_completion(
+                    task.get("completed_time"), fields.get("completed_time")
+                )
+            task.update(fields)
+            task["updated_at"] = time.time()
+
+    def _move_completion(self, old, new):
+        old_day = get_day(old) if old else None
+        new_day = get_day(new) if new else None
+        if old_day == new_day:
+            return
+        if old_day:
+            count = self.heatmap.get(old_day, 0) - 1
+            if count > 0:
+                self.heatmap[old_day] = count
+            else:
+                self.heatmap.pop(old_day, None)
+        if new_day:
+            self.heatmap[new_day] = self.heatmap.get(new_day, 0) + 1
+
+    def merge(self, paths):
+        """合并分片同步保存的状态
+
+        每个分片都从合并后的状态开始，同一个任务取最后更新的记录；
+        推迟的任务只保存在分片的状态中，以分片的为准。
+        """
+        pending = {}
+        for path in paths:
+            shard = SyncState(path).load()
+            self.seeded = self.seeded or shard.seeded
+            with self.lock:
+                for id, task in shard.tasks.items():
+                    current = self.tasks.get(id)
+                    if current is None or task.get("updated_at", 0) > current.get(
+                        "updated_at", 0
+                    ):
+                        self.tasks[id] = task
+            for entry in shard.pending:
+                pending[entry.get("item").get("id")] = entry
+        self.pending = list(pending.values())
+        self.rebuild_heatmap()
+        return self
+
+    def rebuild_heatmap(self):
+        """根据tasks重新汇总热力图"""
+        with self.lock:
+            heatmap = {}
+            for task in self.tasks.values():
+                if task.get("completed_time"):
+                    day = get_day(task.get("completed_time"))
+                    heatmap[day] = heatmap.get(day, 0) + 1
+            self.heatmap = heatmap
@@ -0,0 +1,122 @@
+import codecs
+import json
+import re
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class JsonStream:
+    """从JSON的字节流中逐个解析出path指向的数组的元素
+
+    只缓存还没有解析的部分，每次最多保存一个元素，不需要等整个响应下载完。
+    顶层其他key的值（比如checkPoint）在遍历结束之后保存在values中，
+    路径上其他层级的值会被丢弃。
+
+        stream = JsonStream(r.iter_content(65536), ("syncTaskBean", "update"))
+        for item in stream:
+            ...
+        stream.values.get("checkPoint")
+    """
+
+    def __init__(self, chunks, path):
+        self.chunks = iter(chunks)
+        self.path = tuple(path)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.values = {}
+
+    def __iter__(self):
+        yield from self.iter_object(self.path, self.values)
+        self.skip_whitespace()
+        if self.pos < len(self.buffer):
+            raise ValueError("JSON结束之后还有多余的内容")
+
+    def fill(self):
+        """读取下一段数据，已经解析的部分从缓存中去掉，没有数据时返回False"""
+        for chunk in self.chunks:
+            text = self.decoder.decode(chunk)
+            if text:
+                self.buffer = self.buffer[self.pos :] + text
+                self.pos = 0
+                return True
+        if not self.eof:
+            self.eof = True
+            text = self.decoder.decode(b"", final=True)
+            self.buffer = self.buffer[self.pos :] + text
+            self.pos = 0
+            return bool(text)
+        return False
+
+    def skip_whitespace(self):
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self.fill():
+                return
+
+    def peek(self):
+        self.skip_whitespace()
+        if self.pos >= len(self.buffer):
+            raise ValueError("JSON不完整")
+        return self.buffer[self.pos]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"位置{self.pos}应该是{char}")
+        self.pos += 1
+
+    def decode(self):
+        """解析下一个完整的值"""
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+                # 数字可能被切断在缓存的末尾，需要读到后面的内容才能确定
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            if not self.fill() and self.eof and self.pos >= len(self.buffer):
+                raise ValueError("JSON不完整")
+
+    def iter_object(self, path, values=None):
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.decode()
+            self.expect(":")
+            if key == path[0]:
+                if len(path) == 1:
+                    yield from self.iter_array()
+                else:
+                    yield from self.iter_object(path[1:])
+            else:
+                value = self.decode()
+                if values is not None:
+                    values[key] = value
+            char = self.peek()
+            self.pos += 1
+            if char == "}":
+                return
+            if char != ",":
+                raise ValueError(f"位置{self.pos}应该是,或者}}")
+
+    def iter_array(self):
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.decode()
+            char = self.peek()
+            self.pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(f"位置{self.pos}应该是,或者]")
@@ -1,26 +1,31 @@
 #!/usr/bin/python
 # -*- coding: UTF-8 -*-
 import argparse
+import difflib
+import hashlib
 import io
+import itertools
 import json
-import math
 import mimetypes
+import multiprocessing
 import os
+import signal
+import threading
 import time
-from typing import List
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from urllib.parse import unquote, urlparse
 
-import pendulum
-from todo2notion.notion_helper import NotionHelper, TAG_ICON_URL
-import mistletoe
-from todo2notion.notion_renderer import NotionPyRenderer
-import requests
-from dotenv import load_dotenv
+from notion_client import APIResponseError
 
+from todo2notion.notion_helper import LazyNotionHelper, TAG_ICON_URL
+from todo2notion.date_dimension import DateDimension
+from todo2notion.journal import Journal
+from todo2notion.models import Project, Task, loads
+from todo2notion.note_cache import NoteCache
+from todo2notion.stream import JsonStream
+from todo2notion.state import STATE_DIR, SyncState
 from todo2notion import utils
 
-load_dotenv()
-
 
 headers = {
     "accept": "application/json, text/plain, */*",
@@ -44,11 +49,24 @@ headers = {
 }
 
 
-def is_task_modified(item, todo_dict):
-    id = item.get("id")
-    if item.get("modifiedTime") is None:
+# 正文超过这个长度或者包含图片的任务重新写入的代价比较大
+BODY_HEAVY_LENGTH = 4000
+# 还没有任务完成、无法估计耗时的时候，deadline之前预留的秒数
+DEADLINE_MARGIN = float(os.getenv("DEADLINE_MARGIN", 10))
+# 还没有大任务完成时，大任务预计耗时是普通任务的倍数
+HEAVY_MARGIN_FACTOR = 3
+# 一层中有正文的任务达到这个数量时，在进程池中提前转换Markdown
+MARKDOWN_POOL_THRESHOLD = int(os.getenv("MARKDOWN_POOL_THRESHOLD", 20))
+# 这些类型的block修改时删除后重新创建
+NOT_UPDATABLE_TYPES = ("image", "file", "video", "pdf", "audio", "table", "column_list")
+
+
+def is_task_modified(item, todo_dict, check_notes=True):
+    """check_notes为False时不检查关联笔记的修改（由webhook通知）"""
+    id = item.id
+    if item.modified_time is None:
         return True
-    modified_time = utils.parse_date(item.get("modifiedTime"))
+    modified_time = item.modified_time
     todo = todo_dict.get(id)
     if todo:
         last_modified_time = utils.get_property_value(
@@ -57,7 +75,7 @@ def is_task_modified(item, todo_dict):
         # 判断笔记是否需要同步
         j = utils.get_property_value(todo.get("properties").get("笔记最后修改时间"))
         notes = utils.get_property_value(todo.get("properties").get("笔记"))
-        if notes:
+        if notes and check_notes:
             if j:
                 note_modification_dict = json.loads(j)
                 for note in notes:
@@ -73,15 +91,21 @@ def is_task_modified(item, todo_dict):
                 return True
         if last_modified_time == modified_time:
             return False
+        # 修改时间变了，但是写入Notion的字段都没有变化
+        fingerprint = (sync_state.get_task(id) or {}).get("fingerprint")
+        if not fingerprint and todo.get("properties").get("指纹"):
+            fingerprint = utils.get_property_value(todo.get("properties").get("指纹"))
+        if fingerprint and fingerprint == item.fingerprint:
+            return False
     return True
 
 
 def is_project_modified(item, project_dict):
     """根据最后修改时间判断是否被修改了"""
-    id = item.get("id")
-    if item.get("modifiedTime") is None:
+    id = item.id
+    if item.modified_time is None:
         return True
-    modified_time = utils.parse_date(item.get("modifiedTime"))
+    modified_time = item.modified_time
     project = project_dict.get(id)
     if project:
         last_modified_time = utils.get_property_value(
@@ -92,8 +116,8 @@ def is_project_modified(item, project_dict):
     return True
 
 
-def get_projects(session, project_dict):
-    """获取所有清单"""
+def get_projects(session, project_dict, shard=None):
+    """获取所有清单，shard不为空时只同步属于这个分片的清单"""
     print("开始获取所有的project")
     start_time = time.time()
     r = session.get("https://api.dida365.com/api/v2/projects", headers=headers)
@@ -101,17 +125,19 @@ def get_projects(session, project_dict):
     if r.ok:
         # 获取映射关系
         d = notion_helper.get_property_type(notion_helper.project_database_id)
-        items = r.json()
+        items = [Project.from_dict(x) for x in loads(r.content)]
         items = list(
             filter(lambda item: is_project_modified(item, project_dict), items)
         )
+        if shard:
+            items = [x for x in items if get_shard(x.id, shard[1]) == shard[0]]
         for item in items:
-            emoji, title = utils.split_emoji_from_string(item.get("name"))
-            id = item.get("id")
+            emoji, title = utils.split_emoji_from_string(item.name)
+            id = item.id
             project = {
                 "标题": title,
                 "id": id,
-                "最后修改时间": utils.parse_date(item.get("modifiedTime")),
+                "最后修改时间": item.modified_time,
             }
             icon = {"type": "emoji", "emoji": emoji}
             properties = utils.get_properties(project, d)
@@ -127,7 +153,7 @@ def get_projects(session, project_dict):
                     "type": "database_id",
                 }
                 result = notion_helper.create_page(
-                    parent=parent, properties=properties, icon=icon
+                    parent=parent, properties=properties, icon=icon, key=("id", id)
                 )
                 project_dict[id] = result
     else:
@@ -144,161 +170,517 @@ def remove_duplicates(data):
     return unique_data
 
 
-def get_all_completed(session):
-    """获取所有完成的任务"""
-    print("开始获取所有完成的任务")
-    start_time = time.time()
-    date = pendulum.now()
+def get_completed_window(session, start, end):
+    """获取start到end之间完成的任务，start为None时从最早的任务开始
+
+    接口按完成时间从新到旧返回，每页最后一个任务的完成时间作为下一页的to。
+    """
+    import pendulum
+
+    tz = headers.get("x-tz") or "UTC"
+    start = start.format("YYYY-MM-DD HH:mm:ss") if start else ""
     result = []
+    to = None
     while True:
-        to = date.format("YYYY-MM-DD HH:mm:ss")
+        last = to
+        to = end.format("YYYY-MM-DD HH:mm:ss")
+        if to == last:
+            # 同一秒完成的任务超过一页，无法继续翻页
+            print(f"{to}完成的任务超过100个，跳过剩下的部分")
+            break
         r = session.get(
-            f"https://api.dida365.com/api/v2/project/all/completedInAll/?from=&to={to}&limit=100",
+            f"https://api.dida365.com/api/v2/project/all/completedInAll/?from={start}&to={to}&limit=100",
             headers=headers,
         )
-        if r.ok:
-            l = r.json()
-            if l:
-                result.extend(l)
-                completedTime = l[-1].get("completedTime")
-                date = pendulum.parse(completedTime)
-            if len(l) < 100:
-                break
-        else:
+        if not r.ok:
             print(f"获取任务失败 {r.text}")
-    result = remove_duplicates(result)
+            break
+        l = loads(r.content)
+        result.extend(l)
+        if len(l) < 100:
+            break
+        end = pendulum.parse(l[-1].get("completedTime")).in_timezone(tz)
+    return result
+
+
+def get_month_windows(since, until):
+    """把since到until按自然月切分成[(开始, 结束)]"""
+    windows = []
+    start = since
+    while start < until:
+        end = min(start.start_of("month").add(months=1), until)
+        windows.append((start, end))
+        start = end
+    return windows
+
+
+def get_all_completed(session, since=None, until=None):
+    """获取所有完成的任务
+
+    since为空时从现在开始逐页向前获取，每一页都依赖上一页的结果，只能串行。
+    指定了since时按月切分时间范围，用COMPLETED_WORKERS个线程并发获取，
+    窗口边界上重复返回的任务按id去重。
+    """
+    import pendulum
+
+    print("开始获取所有完成的任务")
+    start_time = time.time()
+    tz = headers.get("x-tz") or "UTC"
+    until = pendulum.parse(until, tz=tz) if until else pendulum.now(tz)
+    if since is None:
+        result = get_completed_window(session, None, until)
+    else:
+        windows = get_month_windows(pendulum.parse(since, tz=tz), until)
+        lock = threading.Lock()
+        finished = []
+
+        def fetch(window):
+            tasks = get_completed_window(session, *window)
+            with lock:
+                finished.append(window)
+                print(
+                    f"{window[0].format('YYYY-MM-DD')}到{window[1].format('YYYY-MM-DD')}"
+                    f"完成{len(tasks)}个任务，进度{len(finished)}/{len(windows)}"
+                )
+            return tasks
+
+        with ThreadPoolExecutor(
+            max_workers=int(os.getenv("COMPLETED_WORKERS", 4))
+        ) as executor:
+            # 从新到旧合并，和串行获取的顺序一致
+            result = [x for tasks in executor.map(fetch, reversed(windows)) for x in tasks]
+    result = [Task.from_dict(x) for x in remove_duplicates(result)]
+    print(f"共{len(result)}个完成的任务")
     utils.log_request_duration("获取所有完成的任务", start_time)
     return result
 
 
-def get_all_task(session):
-    """获取所有未完成的任务"""
+def may_be_modified(item, todo_dict):
+    """不请求Notion判断任务是否可能被修改了，关联了笔记的任务要在同步时再检查笔记"""
+    todo = todo_dict.get(item.id)
+    if todo and todo.get("properties").get("笔记"):
+        if utils.get_property_value(todo.get("properties").get("笔记")):
+            return True
+    return is_task_modified(item, todo_dict, check_notes=False)
+
+
+def get_all_task(session, check_point=0, todo_dict=None):
+    """获取所有未完成的任务，check_point不为0时只返回该检查点之后变化的任务
+
+    响应边下载边解析，同一时间只保存一个任务的原始数据。todo_dict不为空时（省内存模式）
+    每解析出一个任务就和Notion中的比较，只保留可能被修改了的任务。
+    """
     print("开始获取所有未完成的任务")
     start_time = time.time()
-    r = session.get("https://api.dida365.com/api/v2/batch/check/0", headers=headers)
-    utils.log_request_duration("获取所有未完成的任务", start_time)
+    r = session.get(
+        f"https://api.dida365.com/api/v2/batch/check/{check_point}",
+        headers=headers,
+        stream=True,
+    )
     results = []
     if r.ok:
-        results.extend(r.json().get("syncTaskBean").get("update"))
+        stream = JsonStream(r.iter_content(65536), ("syncTaskBean", "update"))
+        for x in stream:
+            item = Task.from_dict(x)
+            if todo_dict is None or may_be_modified(item, todo_dict):
+                results.append(item)
+        check_point = stream.values.get("checkPoint", check_point)
     else:
         print(f"获取任务失败 {r.text}")
-    return results
+    r.close()
+    utils.log_request_duration("获取所有未完成的任务", start_time)
+    return results, check_point
 
 
-def get_task(session):
+def get_task(session, check_point=0, todo_dict=None):
     """获取所有清单"""
     # results = get_all_completed(session)
     results = []
-    results.extend(get_all_task(session))
-    return results
+    tasks, check_point = get_all_task(session, check_point, todo_dict)
+    results.extend(tasks)
+    return results, check_point
+
+
+def get_task_time(item):
+    """任务关联到哪一天：完成的任务是完成时间，否则是开始时间"""
+    return item.completed_time or item.start_date
+
+
+def is_heavy_task(item):
+    content = item.content or ""
+    return len(content) > BODY_HEAVY_LENGTH or "![" in content
+
+
+def get_task_priority(item, now):
+    """同步的优先级，越小越先同步
+
+    正文很大的任务重新写入的代价最高，放到最后；其次快要到期的任务优先，
+    再按最后修改时间从新到旧。
+    """
+    heavy = is_heavy_task(item)
+    due_soon = item.due_date is not None and (
+        now - 86400 <= item.due_date <= now + 2 * 86400
+    )
+    return (heavy, not due_soon, -(item.modified_time or 0))
+
+
+def record_task_duration(item, duration):
+    """记录同步一个任务的耗时，用来估计后面的任务需要多少时间"""
+    with duration_lock:
+        entry = task_durations[is_heavy_task(item)]
+        entry[0] += 1
+        entry[1] += duration
+
+
+def get_task_margin(item):
+    """预计同步这个任务需要的秒数
+
+    使用已经完成的同类任务的平均耗时；还没有大任务完成时，按普通任务的
+    平均耗时乘以HEAVY_MARGIN_FACTOR估计，都没有时使用DEADLINE_MARGIN。
+    """
+    heavy = is_heavy_task(item)
+    factor = 1
+    with duration_lock:
+        count, total = task_durations[heavy]
+        if not count and heavy:
+            count, total = task_durations[False]
+            factor = HEAVY_MARGIN_FACTOR
+    if not count:
+        return DEADLINE_MARGIN * (HEAVY_MARGIN_FACTOR if heavy else 1)
+    return total / count * factor
 
 
-def add_task_to_notion(items, project_dict, todo_dict, session, page_id=None):
+def is_deadline_reached(deadline, item=None):
+    """是否不能再开始新的任务，item不为空时剩余时间要够同步完这个任务"""
+    if stop_event.is_set():
+        return True
+    if deadline is None:
+        return False
+    margin = get_task_margin(item) if item is not None else 0
+    return time.time() + margin >= deadline
+
+
+def add_task_to_notion(
+    items,
+    project_dict,
+    todo_dict,
+    session,
+    page_id=None,
+    check_notes=True,
+    pending=None,
+    deadline=None,
+    force=None,
+):
+    """同步任务以及子任务
+
+    任务树按层展开，父任务所在的层同步完拿到页面id之后，再并发同步下一层，
+    同一层按优先级排序。pending是上次推迟的(任务, 父任务页面id, 层)，
+    会和同一层的任务一起同步，如果这次父任务也重新同步了就以这次为准。
+    剩余时间不够同步完一个任务（按已完成任务的平均耗时估计）时不再开始它，
+    返回被推迟的(任务, 父任务页面id, 层)。
+    force中的任务不检查是否修改过，直接重新同步，force为True时所有任务都重新同步。
+    """
     d = notion_helper.get_property_type(notion_helper.todo_database_id)
-    items = list(filter(lambda item: is_task_modified(item, todo_dict), items))
-    for index, item in enumerate(items):
-        id = item.get("id")
-        task = {"标题": item.get("title"), "id": id, "状态": "Not started"}
-        if page_id:
-            task["Parent task"] = [page_id]
-        if item.get("projectId") and item.get("projectId") in project_dict:
-            task["清单"] = [project_dict.get(item.get("projectId")).get("id")]
-        if item.get("startDate"):
-            task["开始时间"] = utils.parse_date(item.get("startDate"))
-            task["time"] = item.get("startDate")
-        if item.get("dueDate"):
-            task["结束时间"] = utils.parse_date(item.get("dueDate"))
-        if item.get("modifiedTime"):
-            task["最后修改时间"] = utils.parse_date(item.get("modifiedTime"))
-        if item.get("progress"):
-            task["进度"] = item.get("progress") / 100
-        persons = [
-            x
-            for x in notion_helper.client.users.list().get("results")
-            if x.get("type") == "person"
-        ]
-        if persons:
-            task["Assignee"] = persons
-        if item.get("tags"):
-            task["标签"] = [
-                notion_helper.get_relation_id(
-                    x, notion_helper.tag_database_id, TAG_ICON_URL
-                )
-                for x in item.get("tags")
-            ]
-        parent = {
-            "database_id": notion_helper.todo_database_id,
-            "type": "database_id",
-        }
-        icon = "https://www.notion.so/icons/circle_outline_green.svg"
-        properties = {}
-        if item.get("completedTime"):
-            task["状态"] = "Done"
-            task["完成时间"] = utils.parse_date(item.get("completedTime"))
-            task["time"] = item.get("completedTime")
-            icon = "https://www.notion.so/icons/checkmark_circle_green.svg"
-        blocks = []
-        if id in todo_dict:
-            notes = utils.get_property_value(
-                todo_dict.get(id).get("properties").get("笔记")
+    pending_levels = {}
+    for item, parent, depth in pending or []:
+        pending_levels.setdefault(depth, []).append((item, parent))
+    level = [(item, page_id) for item in items]
+    depth = 1
+    completed = 0
+    deferred = []
+    with ThreadPoolExecutor(max_workers=int(os.getenv("SYNC_WORKERS", 4))) as executor:
+        while level or pending_levels:
+            ids = {item.id for item, _ in level}
+            level.extend(x for x in pending_levels.pop(depth, []) if x[0].id not in ids)
+            if is_deadline_reached(deadline):
+                deferred.extend((item, parent, depth) for item, parent in level)
+                for pending_depth, entries in pending_levels.items():
+                    deferred.extend((x, y, pending_depth) for x, y in entries)
+                break
+            start_time = time.time()
+            modified = executor.map(
+                lambda x: force is True
+                or x[0].id in (force or ())
+                or is_task_modified(x[0], todo_dict, check_notes),
+                level,
             )
-            if notes:
-                task["笔记"] = [x.get("id") for x in notes]
-                note_modification_dict = {}
-                for i in notes:
-                    note_page = notion_helper.client.pages.retrieve(i.get("id"))
-                    last_edited_time = note_page.get("last_edited_time")
-                    note_modification_dict[i.get("id")] = last_edited_time
-                task["笔记最后修改时间"] = json.dumps(
-                    note_modification_dict, ensure_ascii=False
+            level = [x for x, is_modified in zip(level, list(modified)) if is_modified]
+            level.sort(key=lambda x: get_task_priority(x[0], start_time))
+            date_dimension.prepare(get_task_time(item) for item, _ in level)
+            markdown = prefetch_markdown([item for item, _ in level])
+
+            def run(x):
+                if is_deadline_reached(deadline, x[0]):
+                    return None
+                task_start_time = time.time()
+                result = add_one_task_to_notion(
+                    x[0],
+                    d,
+                    project_dict,
+                    todo_dict,
+                    session,
+                    x[1],
+                    markdown.pop(x[0].id, None),
                 )
+                record_task_duration(x[0], time.time() - task_start_time)
+                return result
 
-            for note in notes:
-                blocks.extend(notion_helper.get_block_children(note.get("id")))
-            notion_helper.delete_block(todo_dict.get(id).get("id"))
-        properties = {}
-        notion_helper.get_all_relation(properties)
-        if task.get("time"):
-            chinese_weekdays = [
-                "星期一",
-                "星期二",
-                "星期三",
-                "星期四",
-                "星期五",
-                "星期六",
-                "星期日",
+            results = list(executor.map(run, level))
+            # 到了deadline没有用到的转换结果
+            for future in markdown.values():
+                future.cancel()
+            utils.log_request_duration(f"同步第{depth}层{len(level)}个任务", start_time)
+            deferred.extend(
+                (item, parent, depth)
+                for (item, parent), result in zip(level, results)
+                if result is None
+            )
+            completed += sum(1 for x in results if x is not None)
+            level = [
+                (child, result.get("id"))
+                for (item, _), result in zip(level, results)
+                if result is not None
+                for child in item.items
             ]
-            date = pendulum.parse(task.get("time"))
-            date = date.in_timezone("Asia/Shanghai")
-            chinese_day_of_week = chinese_weekdays[date.day_of_week]
-            task["星期"] = chinese_day_of_week
-            notion_helper.get_date_relation(properties, date)
-        properties.update(utils.get_properties(task, d))
-        result = notion_helper.create_page(
-            parent=parent, properties=properties, icon=utils.get_icon(icon)
+            depth += 1
+    if deadline is not None or deferred:
+        print(f"完成{completed}个任务，推迟{len(deferred)}个任务到下次同步")
+    return deferred
+
+
+def add_one_task_to_notion(
+    item, d, project_dict, todo_dict, session, page_id=None, markdown=None
+):
+    """同步一个任务，不包括子任务，返回创建的页面
+
+    markdown是进程池中正在转换正文的Future，为空时在当前线程转换。
+    """
+    id = item.id
+    task = {
+        "标题": item.title,
+        "id": id,
+        "状态": "Not started",
+        "指纹": item.fingerprint,
+    }
+    if page_id:
+        task["Parent task"] = [page_id]
+    if item.project_id and item.project_id in project_dict:
+        task["清单"] = [project_dict.get(item.project_id).get("id")]
+    if item.start_date:
+        task["开始时间"] = item.start_date
+        task["time"] = task["开始时间"]
+    if item.due_date:
+        task["结束时间"] = item.due_date
+    if item.modified_time:
+        task["最后修改时间"] = item.modified_time
+    if item.progress:
+        task["进度"] = item.progress / 100
+    persons = notion_helper.get_persons()
+    if persons:
+        task["Assignee"] = persons
+    if item.tags:
+        task["标签"] = [
+            notion_helper.get_relation_id(
+                x, notion_helper.tag_database_id, TAG_ICON_URL
+            )
+            for x in item.tags
+        ]
+    parent = {
+        "database_id": notion_helper.todo_database_id,
+        "type": "database_id",
+    }
+    icon = "https://www.notion.so/icons/circle_outline_green.svg"
+    properties = {}
+    if item.completed_time:
+        task["状态"] = "Done"
+        task["完成时间"] = item.completed_time
+        task["time"] = task["完成时间"]
+        icon = "https://www.notion.so/icons/checkmark_circle_green.svg"
+    blocks = []
+    if id in todo_dict:
+        notes = utils.get_property_value(
+            todo_dict.get(id).get("properties").get("笔记")
         )
-        todo_dict[id] = result
-        if item.get("content"):
-            blocks = (
-                convert_to_block(id, item.get("projectId"), item.get("content"),session)
-                + blocks
+        if notes:
+            task["笔记"] = [x.get("id") for x in notes]
+            note_modification_dict = {}
+            for i in notes:
+                note_page = notion_helper.client.pages.retrieve(i.get("id"))
+                last_edited_time = note_page.get("last_edited_time")
+                note_modification_dict[i.get("id")] = last_edited_time
+                blocks.extend(note_cache.get_blocks(i.get("id"), last_edited_time))
+            task["笔记最后修改时间"] = json.dumps(
+                note_modification_dict, ensure_ascii=False
+            )
+    old = todo_dict.get(id).get("id") if id in todo_dict else None
+    properties = {}
+    notion_helper.get_all_relation(properties)
+    if task.get("time"):
+        task["星期"] = date_dimension.get_weekday(task.get("time"))
+        date_dimension.get_date_relation(properties, task.get("time"))
+    properties.update(utils.get_properties(task, d))
+    mark, upload = get_attachment_uploader(id, item.project_id, session)
+    if item.content:
+        blocks = itertools.chain(mark(convert_to_block(item.content, markdown)), blocks)
+    state = sync_state.get_task(id) or {}
+    # 快照只对写入它的页面有效，页面被其他进程替换过时重新创建
+    snapshot = state.get("blocks") if old and state.get("page") == old else None
+    if snapshot is not None:
+        # 有上次写入的快照时原地更新，页面id不变，只修改正文中变化的block
+        blocks = list(blocks)
+        journal.begin(id, old)
+        journal.done(id, "create", page=old)
+        try:
+            snapshot = reconcile_blocks(old, snapshot, blocks, upload)
+        except APIResponseError as e:
+            # 快照中的block在Notion中被删除或者移动了，页面按快照已经无法更新
+            print(f"更新正文失败，重新创建页面: {e}")
+            snapshot = None
+        if snapshot is not None:
+            journal.done(id, "append", page=old)
+            # 属性最后更新，中断时最后修改时间还是旧的，下次会重新同步
+            result = notion_helper.update_page(
+                page_id=old, properties=properties, icon=utils.get_icon(icon)
+            )
+            todo_dict[id] = result
+            sync_state.update_task(
+                id,
+                completed_time=task.get("完成时间"),
+                fingerprint=item.fingerprint,
+                blocks=snapshot,
+                page=old,
             )
-        if blocks:
-            append_block(result.get("id"), blocks)
-        if item.get("items"):
-            add_task_to_notion(item.get("items"),project_dict, todo_dict, session, result.get("id"))
+            journal.done(id, "delete", page=old)
+            return result
+        journal.done(id, "rollback")
+    # 先创建新页面再删除旧页面，每一步都记录到日志中，中断后可以恢复
+    journal.begin(id, old)
+    result = notion_helper.create_page(
+        parent=parent,
+        properties=properties,
+        icon=utils.get_icon(icon),
+        key=("id", id),
+        exclude=old,
+    )
+    journal.done(id, "create", page=result.get("id"))
+    todo_dict[id] = result
+    snapshot = append_block(result.get("id"), blocks, prepare=upload)
+    journal.done(id, "append", page=result.get("id"))
+    # 正文写完之后才记录指纹，中断时下次还会认为任务被修改了
+    sync_state.update_task(
+        id,
+        completed_time=task.get("完成时间"),
+        fingerprint=item.fingerprint,
+        blocks=snapshot,
+        page=result.get("id"),
+    )
+    if old:
+        notion_helper.delete_block(old)
+    journal.done(id, "delete", page=result.get("id"))
+    return result
+
+
+def replay_journal():
+    """恢复上次中断的任务
+
+    这些任务页面正文的状态不确定，不能再按快照更新，也不能按指纹跳过。
+    """
+    return journal.replay(
+        notion_helper,
+        on_incomplete=lambda id: sync_state.update_task(id, fingerprint=None, blocks=None),
+    )
+
+
+def upload_file_to_notion(file_name, file_content):
+    file_size = len(file_content)
+    if file_size == 0:
+        print("文件内容为空，跳过上传")
+        return None
+    file_uploads_endpoint = getattr(notion_helper.client, "file_uploads", None)
+    if file_uploads_endpoint:
+        print(f"上传Notion文件，文件名: {file_name}, 大小: {file_size} 字节")
+        if file_size > 20 * 1024 * 1024:
+            pass  # Notion SDK目前不支持大于20MB的文件上传
+        try:
+            create_resp = file_uploads_endpoint.create(
+                mode="single_part",
+                filename=file_name,
+            )
+            file_upload_id = create_resp.get("id")
+            print(f"创建文件上传，文件ID: {file_upload_id}")
+            file_like = io.BytesIO(file_content)
+            file_like.name = file_name  # type: ignore[attr-defined]
+            file_like.seek(0)
+            send_resp = file_uploads_endpoint.send(
+                file_upload_id=file_upload_id,
+                file=file_like,
+            )
+            print(f"发送文件上传，响应状态: {send_resp.get('status')}")
+            if send_resp.get("status") != "uploaded":
+                raise Exception(
+                    f"File upload failed with status: {send_resp.get('status')}"
+                )
+
+            return file_upload_id
+        except Exception as exc:
+            print(f"上传Notion文件异常: {exc}")
+            return None
 
 
-def convert_to_block(id, project_id, content, session):
-    with open("debug_markdown.md", "w", encoding="utf-8") as f:
-        f.write(content)
+def process_image_blocks(block_list, id, project_id, session):
+    """把滴答清单的附件下载后上传到Notion"""
+    for block in block_list:
+        type = block.get("type")
+        if type == "image" or type == "file":
+            url = block.get(type, {}).get("external", {}).get("url")
+            if not url:
+                continue
+            parsed_url = urlparse(url)
+            paths = unquote(parsed_url.path).strip("/").split("/")
+            if len(paths) < 2:
+                continue
+            print(f"处理图片块，Url: {paths}")
+            dir_name = paths[-2]
+            file_name = paths[-1]
+            print(f"处理图片块，文件名: {mimetypes.guess_type(file_name)[0]}")
+            download_url = f"https://api.dida365.com/api/v1/attachment/{project_id}/{id}/{dir_name}?action=download"
+            action_download = f"下载图片 {download_url}"
+            print(f"开始{action_download}")
+            download_start_time = time.time()
+            response = session.get(download_url, headers=headers)
+            print(f"完成{action_download} {response.status_code} ")
+            utils.log_request_duration(action_download, download_start_time)
+            if response.status_code == 200:
+                file_upload_id = upload_file_to_notion(file_name, response.content)
+                print(f"上传Notion文件，文件ID: {file_upload_id}")
+                if file_upload_id:
+                    image_block = {
+                        "type": "file_upload",
+                        "file_upload": {"id": file_upload_id},
+                    }
+                    caption = block.get(type, {}).get("caption")
+                    if caption:
+                        image_block["caption"] = caption
+                    print(f"更新图片块链接，文件ID: {image_block}")
+                    block[type] = image_block
+            else:
+                print(f"文件下载失败，状态码: {response.status_code}")
+        # 递归处理子块中的图片
+        if block.get("children"):
+            process_image_blocks(block.get("children"), id, project_id, session)
+
+
+def convert_remote(content):
+    """使用MARKDOWN_CONVERTER_URL对应的服务转换Markdown"""
+    from todo2notion import transport
+
     action = "Markdown转换为Notion block"
     print(f"开始{action}")
     start_time = time.time()
     blocks = []
     try:
-        response = requests.post(
-            "http://127.0.0.1:8787",
+        response = transport.get_session().post(
+            os.getenv("MARKDOWN_CONVERTER_URL", "http://127.0.0.1:8787"),
             data=content.encode("utf-8"),
             headers={"content-type": "text/markdown"},
             timeout=30,
@@ -310,135 +692,576 @@ def convert_to_block(id, project_id, content, session):
     except Exception as exc:
         print(f"{action}异常: {exc}")
     utils.log_request_duration(action, start_time)
-
-    def upload_file_to_notion(file_name, file_content):
-        file_size = len(file_content)
-        if file_size == 0:
-            print("文件内容为空，跳过上传")
-            return None
-        file_uploads_endpoint = getattr(notion_helper.client, "file_uploads", None)
-        if file_uploads_endpoint:
-            file_size = len(response.content)
-            with open("debug_downloaded_file", "wb") as f:
-                f.write(response.content)
-            print(f"上传Notion文件，文件名: {file_name}, 大小: {file_size} 字节")
-            if file_size > 20 * 1024 * 1024:
-                pass  # Notion SDK目前不支持大于20MB的文件上传
-            try:
-                create_resp = file_uploads_endpoint.create(
-                    mode="single_part",
-                    filename=file_name,
-                )
-                file_upload_id = create_resp.get("id")
-                print(f"创建文件上传，文件ID: {file_upload_id}")
-                file_like = io.BytesIO(file_content)
-                file_like.name = file_name  # type: ignore[attr-defined]
-                file_like.seek(0)
-                send_resp = file_uploads_endpoint.send(
-                    file_upload_id=file_upload_id,
-                    file=file_like,
-                )
-                print(f"发送文件上传，响应状态: {send_resp.get('status')}")
-                if send_resp.get("status") != "uploaded":
-                    raise Exception(
-                        f"File upload failed with status: {send_resp.get('status')}"
-                    )
-
-                return file_upload_id
-            except Exception as exc:
-                print(f"上传Notion文件异常: {exc}")
-                return None
-
-    def process_image_blocks(block_list):
-        for block in block_list:
-            type = block.get("type")
-            if type == "image" or type == "file":
-                url = block.get(type, {}).get("external", {}).get("url")
-                if not url:
-                    continue
-                parsed_url = urlparse(url)
-                paths = unquote(parsed_url.path).strip("/").split("/")
-                if len(paths) < 2:
-                    continue
-                print(f"处理图片块，Url: {paths}")
-                dir_name = paths[-2]
-                file_name = paths[-1]
-                print(f"处理图片块，文件名: {mimetypes.guess_type(file_name)[0]}")
-                download_url = f"https://api.dida365.com/api/v1/attachment/{project_id}/{id}/{dir_name}?action=download"
-                action_download = f"下载图片 {download_url}"
-                print(f"开始{action_download}")
-                download_start_time = time.time()
-                response = session.get(download_url, headers=headers)
-                print(f"完成{action_download} {response.status_code} ")
-                with open("debug_downloaded_image.png", "wb") as f:
-                    f.write(response.content)
-                utils.log_request_duration(action_download, download_start_time)
-                if response.status_code == 200:
-                    file_upload_id = upload_file_to_notion(
-                        file_name, response.content
-                    )
-                    print(f"上传Notion文件，文件ID: {file_upload_id}")
-                    if file_upload_id:
-                        image_block = {
-                            "type": "file_upload",
-                            "file_upload": {"id": file_upload_id},
-                        }
-                        caption = block.get(type, {}).get("caption")
-                        if caption:
-                            image_block["caption"] = caption
-                        print(f"更新图片块链接，文件ID: {image_block}")
-                        block[type] = image_block
-                else:
-                    print(f"文件下载失败，状态码: {response.status_code}")
-            # 递归处理子块中的图片
-            if block.get("children"):
-                process_image_blocks(block.get("children"))
-
-    process_image_blocks(blocks)
-    with open("debug_notion_blocks.json", "w", encoding="utf-8") as f:
-        json.dump(blocks, f, ensure_ascii=False, indent=4)
     return blocks
 
 
+def get_attachment_uploader(task_id, project_id, session):
+    """返回(mark, upload)，正文的block经过mark之后，upload才会上传其中的附件
 
-def append_block(block_id, blocks):
-    for block in blocks:
-        children = []
-        # Some renderers put nested blocks at the root level, others under the typed payload
-        root_children = block.pop("children", None)
-        if root_children:
-            children.extend(root_children if isinstance(root_children, list) else [root_children])
-        type_key = block.get("type")
-        if type_key:
-            type_children = block.get(type_key, {}).pop("children", None)
-            if type_children:
-                children.extend(type_children if isinstance(type_children, list) else [type_children])
-        id = (
-            notion_helper.client.blocks.children.append(
-                block_id=block_id, children=[block]
-            )
-            .get("results")[0]
-            .get("id")
+    附件在计算block的指纹之后、写入Notion之前才上传，上传得到的id每次都不同，
+    没有变化的附件不会被重新下载和上传。笔记中的block不经过mark，不会被处理。
+    """
+    marked = set()
+
+    def mark(blocks):
+        for block in blocks:
+            marked.add(id(block))
+            yield block
+
+    def upload(block):
+        if id(block) in marked:
+            process_image_blocks([block], task_id, project_id, session)
+
+    return mark, upload
+
+
+def convert_to_block(content, markdown=None):
+    """Markdown转换为Notion block，逐个生成顶层block
+
+    MARKDOWN_CONVERTER=local时在本地使用NotionPyRenderer边转换边生成，
+    否则使用MARKDOWN_CONVERTER_URL对应的转换服务。markdown不为空时使用
+    进程池中提前转换的结果。
+    """
+    if markdown is not None:
+        blocks = markdown.result()
+    elif os.getenv("MARKDOWN_CONVERTER") == "local":
+        from todo2notion.notion_renderer import iter_markdown_blocks
+
+        blocks = iter_markdown_blocks(content)
+    else:
+        blocks = convert_remote(content)
+    yield from blocks
+
+
+def get_markdown_pool():
+    """转换Markdown的进程池，默认每个CPU一个进程，只在第一次用到时创建"""
+    global markdown_pool
+    if markdown_pool is None:
+        workers = int(os.getenv("MARKDOWN_WORKERS", 0)) or os.cpu_count()
+        # 同步线程已经在运行，fork出来的进程可能继承被占用的锁
+        markdown_pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
         )
+    return markdown_pool
+
+
+def prefetch_markdown(items):
+    """把一层任务的正文按同步的顺序提交到进程池转换，返回id -> Future
+
+    mistletoe的解析和渲染都在CPU上，放在同步线程里会和网络请求交替进行。
+    提前提交之后写入Notion的线程取结果时通常已经转换好了。
+    任务较少时进程池的开销不划算，返回空字典，在同步线程中转换。
+    """
+    if os.getenv("MARKDOWN_CONVERTER") != "local":
+        return {}
+    items = [x for x in items if x.content]
+    if len(items) < MARKDOWN_POOL_THRESHOLD:
+        return {}
+    from todo2notion.notion_renderer import render_markdown_blocks
+
+    pool = get_markdown_pool()
+    return {x.id: pool.submit(render_markdown_blocks, x.content) for x in items}
+
+
+def pop_children(block):
+    """取出block的子block，Notion不支持一次创建多层嵌套"""
+    children = []
+    # Some renderers put nested blocks at the root level, others under the typed payload
+    root_children = block.pop("children", None)
+    if root_children:
+        children.extend(root_children if isinstance(root_children, list) else [root_children])
+    type_key = block.get("type")
+    if type_key == "table":
+        # 表格必须和行一起创建，超过100行的部分在表格创建后再追加
+        rows = block.get(type_key).get("children") or []
+        block.get(type_key)["children"] = rows[: utils.MAX_CHILDREN]
+        children.extend(rows[utils.MAX_CHILDREN :])
+    elif type_key:
+        type_children = block.get(type_key, {}).pop("children", None)
+        if type_children:
+            children.extend(type_children if isinstance(type_children, list) else [type_children])
+    return children
+
+
+def get_request_count(block):
+    """block在追加请求中占的数量，子block另外追加，只有表格带着最多100行"""
+    if block.get("type") == "table":
+        rows = block.get("table").get("children") or []
+        return 1 + min(len(rows), utils.MAX_CHILDREN)
+    return 1
+
+
+def get_block_hash(block):
+    """block及所有子block的指纹，在上传之前计算"""
+    value = json.dumps(block, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()[:16]
+
+
+def has_children(block):
+    type = block.get("type")
+    return bool(block.get("children") or (block.get(type) or {}).get("children"))
+
+
+def append_chunk(block_id, chunk, after=None):
+    """追加一组block，after不为空时插入到这个block后面，返回创建的block的id"""
+    children_list = [pop_children(block) for block in chunk]
+    results = []
+    for children in utils.split_children(chunk):
+        if after:
+            response = notion_helper.append_blocks_after(
+                block_id=block_id, children=children, after=after
+            )
+        else:
+            response = notion_helper.append_blocks(block_id=block_id, children=children)
+        results.extend(response.get("results"))
+        if after:
+            after = results[-1].get("id")
+    for result, children in zip(results, children_list):
         if children:
-            append_block(id, children)
+            append_block(result.get("id"), children)
+    return [x.get("id") for x in results]
 
 
-def main():
-    session = requests.Session()
+def append_block(
+    block_id, blocks, chunk_size=utils.MAX_CHILDREN, after=None, prepare=None
+):
+    """追加block，每次请求最多chunk_size个，blocks可以是生成器
+
+    生成器会被边消费边上传，内存中最多只保留一个chunk。表格的行也计入
+    一次请求的block数量，超过MAX_BLOCK_ELEMENTS之前就发送。超长的文本会被
+    拆分成多个相邻的block。返回顶层block的快照[id, 指纹, 类型, 是否有子block]，
+    下次更新正文时用来比较。prepare在计算指纹之后、写入之前处理每个顶层block。
+    """
+    snapshot = []
+    chunk = []
+    entries = []
+    elements = 0
+
+    def flush():
+        ids = append_chunk(block_id, chunk, after)
+        snapshot.extend([id] + entry for id, entry in zip(ids, entries))
+        chunk.clear()
+        entries.clear()
+        return ids[-1] if after and ids else after
+
+    for block in blocks:
+        if block is None:
+            continue
+        for new_block in utils.split_block(block):
+            count = get_request_count(new_block)
+            if chunk and elements + count > utils.MAX_BLOCK_ELEMENTS:
+                after = flush()
+                elements = 0
+            elements += count
+            entries.append(
+                [get_block_hash(new_block), new_block.get("type"), has_children(new_block)]
+            )
+            if prepare:
+                prepare(new_block)
+            chunk.append(new_block)
+            if len(chunk) == chunk_size:
+                after = flush()
+                elements = 0
+    if chunk:
+        flush()
+    return snapshot
+
+
+def is_block_updatable(entry, block):
+    """类型相同并且都没有子block的可以直接修改内容"""
+    type = block.get("type")
+    return (
+        entry[2] == type
+        and not entry[3]
+        and not has_children(block)
+        and type not in NOT_UPDATABLE_TYPES
+    )
+
+
+def reconcile_blocks(page_id, snapshot, blocks, prepare=None):
+    """按上次写入的快照把页面正文改成blocks，只修改有变化的block
+
+    顶层block按指纹对齐，没有变化的保留，变化的位置上类型相同的直接修改，
+    其余的删除后在原来的位置插入新的。Notion不能在第一个block前面插入，
+    这种情况返回None，由调用方重建页面。成功时返回新的快照。
+    prepare只处理需要插入的block，见append_block。
+    """
+    blocks = [x for block in blocks if block for x in utils.split_block(block)]
+    hashes = [get_block_hash(x) for x in blocks]
+    matcher = difflib.SequenceMatcher(
+        None, [x[1] for x in snapshot], hashes, autojunk=False
+    )
+    opcodes = matcher.get_opcodes()
+    if opcodes and opcodes[0][0] != "equal":
+        tag, i1, i2, j1, j2 = opcodes[0]
+        updatable = i2 > i1 and j2 > j1 and is_block_updatable(snapshot[i1], blocks[j1])
+        if not updatable and j2 > j1 and i2 < len(snapshot):
+            return None
+    result = []
+    after = None
+    requests = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            result.extend(snapshot[i1:i2])
+            after = snapshot[i2 - 1][0]
+            continue
+        old = snapshot[i1:i2]
+        k = 0
+        while k < min(len(old), j2 - j1) and is_block_updatable(old[k], blocks[j1 + k]):
+            notion_helper.update_block(old[k][0], blocks[j1 + k])
+            result.append([old[k][0], hashes[j1 + k], old[k][2], False])
+            after = old[k][0]
+            k += 1
+        requests += k
+        for entry in old[k:]:
+            notion_helper.delete_block(entry[0])
+            requests += 1
+        if j1 + k < j2:
+            entries = append_block(
+                page_id, blocks[j1 + k : j2], after=after, prepare=prepare
+            )
+            result.extend(entries)
+            after = entries[-1][0] if entries else after
+            requests += 1
+    print(f"更新正文{len(snapshot)} -> {len(blocks)}个block，{requests}次修改")
+    return result
+
+
+def get_project_dict():
     projects = notion_helper.query_all(notion_helper.project_database_id)
     project_dict = {}
     for item in projects:
         project_dict[utils.get_property_value(item.get("properties").get("id"))] = item
-    get_projects(session, project_dict)
+    return project_dict
+
+
+def get_todo_dict():
     todos = notion_helper.query_all(notion_helper.todo_database_id)
     todo_dict = {}
     for todo in todos:
         todo_dict[utils.get_property_value(todo.get("properties").get("id"))] = todo
-    tasks = get_task(session)
-    add_task_to_notion(tasks,project_dict,todo_dict,session)
+    return todo_dict
+
+
+def get_shard_path(name, index, count, extension):
+    return os.path.join(STATE_DIR, f"{name}.shard-{index}-of-{count}.{extension}")
+
+
+def merge_shards(count):
+    """合并N个分片保存的状态
+
+    只合并这次的N个分片，缺少任何一个时不合并，否则那个分片推迟的任务会丢失。
+    合并之后删除分片的状态文件，下次合并不会再读到过期的状态。
+    """
+    paths = [get_shard_path("todo", i, count, "json") for i in range(count)]
+    missing = [x for x in paths if not os.path.exists(x)]
+    if missing:
+        raise FileNotFoundError(f"缺少分片的状态文件: {', '.join(missing)}")
+    sync_state.load().merge(paths)
+    sync_state.save()
+    for path in paths:
+        os.remove(path)
+    print(f"合并了{count}个分片的状态")
+
+
+def parse_shard(value):
+    """解析--shard参数i/N，i从0开始"""
+    index, count = (int(x) for x in value.split("/"))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"分片参数不正确: {value}")
+    return index, count
+
+
+def get_shard(project_id, count):
+    """按照清单id分片，使用md5保证每次运行、每个runner上的结果都一样"""
+    digest = hashlib.md5((project_id or "").encode("utf-8")).hexdigest()
+    return int(digest, 16) % count
+
+
+def filter_shard(tasks, shard):
+    """只保留属于这个分片的任务，子任务跟随最上层的父任务所在的清单"""
+    tasks_by_id = {x.id: x for x in tasks}
+
+    def get_root(item):
+        seen = set()
+        while item.parent_id in tasks_by_id and item.id not in seen:
+            seen.add(item.id)
+            item = tasks_by_id.get(item.parent_id)
+        return item
+
+    return [
+        x
+        for x in tasks
+        if get_shard(get_root(x).project_id, shard[1]) == shard[0]
+    ]
+
+
+def prepare(session):
+    """分片同步之前创建所有分片共用的页面：标签、全部以及年、月、周、日
+
+    这些页面是按标题查找或者创建的，多个分片同时创建会产生重复的页面。
+    """
+    tasks, _ = get_task(session)
+    tags = set()
+    days = {}
+    stack = list(tasks)
+    while stack:
+        item = stack.pop()
+        tags.update(item.tags or [])
+        timestamp = get_task_time(item)
+        if timestamp:
+            days.setdefault(utils.timestamp_to_date(timestamp).date(), timestamp)
+        stack.extend(item.items)
+    start_time = time.time()
+    date_dimension.prepare(days.values())
+    notion_helper.get_all_relation({})
+    with ThreadPoolExecutor(max_workers=int(os.getenv("SYNC_WORKERS", 4))) as executor:
+        list(
+            executor.map(
+                lambda x: notion_helper.get_relation_id(
+                    x, notion_helper.tag_database_id, TAG_ICON_URL
+                ),
+                tags,
+            )
+        )
+        list(
+            executor.map(lambda x: date_dimension.get_date_relation({}, x), days.values())
+        )
+    utils.log_request_duration(f"创建{len(tags)}个标签、{len(days)}天的日期页面", start_time)
+
+
+def sync(
+    session,
+    project_dict,
+    todo_dict,
+    check_point=0,
+    check_notes=True,
+    deadline=None,
+    shard=None,
+    low_memory=False,
+    rebuild=False,
+):
+    """同步一次，返回同步的任务和新的检查点
+
+    上次推迟的任务和这次获取的任务一起同步，这次又被推迟的任务保存到sync_state中。
+    shard是(i, N)时只同步第i个分片的清单和任务。low_memory为True时解析任务的同时
+    过滤掉没有修改的任务，返回的任务也只有这些。rebuild为True时不检查是否修改过，
+    所有任务都重新同步。
+    """
+    get_projects(session, project_dict, shard)
+    tasks, check_point = get_task(
+        session, check_point, todo_dict if low_memory and not rebuild else None
+    )
+    pending = [
+        (Task.from_dict(x.get("item")), x.get("parent"), x.get("depth", 1))
+        for x in sync_state.pending
+    ]
+    if shard:
+        tasks = filter_shard(tasks, shard)
+        ids = {x.id for x in filter_shard([x[0] for x in pending], shard)}
+        pending = [x for x in pending if x[0].id in ids]
+    deferred = add_task_to_notion(
+        tasks,
+        project_dict,
+        todo_dict,
+        session,
+        check_notes=check_notes,
+        pending=pending,
+        deadline=deadline,
+        force=rebuild,
+    )
+    sync_state.pending = [
+        {"item": item.to_dict(), "parent": parent, "depth": depth}
+        for item, parent, depth in deferred
+    ]
+    return tasks, check_point
+
+
+def stop(signum, frame):
+    print(f"收到信号{signum}，当前的任务同步完成后退出")
+    stop_event.set()
+
+
+def main():
+    from dotenv import load_dotenv
+
+    from todo2notion import transport
+
+    load_dotenv()
+    headers["cookie"] = os.getenv("COOKIE")
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="sync",
+        choices=["sync", "daemon", "dedup", "prepare", "merge", "verify", "backfill"],
+    )
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=int(os.getenv("DAEMON_INTERVAL", 300)),
+        help="daemon模式下轮询滴答清单的间隔（秒）",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=int,
+        default=int(os.getenv("DAEMON_JITTER", 30)),
+        help="每次轮询间隔额外增加的随机秒数",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=int(os.getenv("DAEMON_PORT", 0)),
+        help="health/metrics接口端口，0表示不启动",
+    )
+    parser.add_argument(
+        "--host",
+        default=os.getenv("DAEMON_HOST", "127.0.0.1"),
+        help="health/metrics接口监听的地址，监听外部地址并开启webhook时必须配置校验",
+    )
+    parser.add_argument(
+        "--webhook",
+        action="store_true",
+        help="在--port端口上接收Notion和滴答清单的webhook通知",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=int,
+        default=int(os.getenv("SYNC_DEADLINE", 0)),
+        help="同步最多运行的秒数，到时间后剩下的任务推迟到下次同步，0表示不限制",
+    )
+    parser.add_argument(
+        "--shard",
+        help="i/N，只同步第i个分片（从0开始），分片之前先运行prepare，之后运行merge合并状态",
+    )
+    parser.add_argument(
+        "--shards", type=int, help="merge时合并的分片数量N，和--shard i/N中的N一致"
+    )
+    parser.add_argument(
+        "--low-memory",
+        action="store_true",
+        default=os.getenv("SYNC_LOW_MEMORY", "").lower() in ("1", "true"),
+        help="解析滴答清单任务的同时过滤掉没有修改的任务，不在内存中保存所有任务",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="不检查是否修改过，重新同步所有任务",
+    )
+    parser.add_argument(
+        "--since",
+        help="backfill时同步这个日期（比如2020-01-01）之后完成的任务，按月并发获取",
+    )
+    parser.add_argument("--until", help="backfill时同步到这个日期，默认是现在")
+    parser.add_argument(
+        "--remote",
+        action="store_true",
+        help="verify时不使用本地状态，所有清单都和Notion比较",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="dedup时只统计重复的页面，verify时只列出不一致的任务，不做修改",
+    )
+    options = parser.parse_args()
+    if options.command == "dedup":
+        from todo2notion.dedup import dedup
+
+        dedup(notion_helper, options.dry_run)
+        return
+    if options.command == "merge":
+        if not options.shards:
+            parser.error("merge需要--shards指定分片数量")
+        merge_shards(options.shards)
+        return
+    session = transport.get_session()
+    if options.command == "prepare":
+        try:
+            prepare(session)
+        finally:
+            transport.save_governors()
+        return
+    if options.command == "verify":
+        from todo2notion.verify import verify
+
+        sync_state.load()
+        try:
+            replay_journal()
+            verify(session, notion_helper, options.remote, options.dry_run)
+        finally:
+            sync_state.save()
+            journal.compact()
+            transport.save_governors()
+        return
+    if options.command == "daemon":
+        from todo2notion.daemon import Daemon
+
+        Daemon(
+            session,
+            options.interval,
+            options.jitter,
+            options.port,
+            int(os.getenv("DAEMON_FULL_SYNC_EVERY", 12)),
+            options.webhook,
+            options.host,
+        ).run()
+        return
+    deadline = time.time() + options.deadline if options.deadline else None
+    # 任务被取消时不再开始新的任务，正在同步的任务完成后保存状态退出
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    if options.command == "backfill":
+        sync_state.load()
+        try:
+            replay_journal()
+            project_dict = get_project_dict()
+            get_projects(session, project_dict)
+            tasks = get_all_completed(session, options.since, options.until)
+            deferred = add_task_to_notion(
+                tasks, project_dict, get_todo_dict(), session, deadline=deadline
+            )
+            # 推迟的任务和sync推迟的任务一起在下次同步
+            sync_state.pending.extend(
+                {"item": item.to_dict(), "parent": parent, "depth": depth}
+                for item, parent, depth in deferred
+            )
+        finally:
+            sync_state.save()
+            journal.compact()
+            transport.save_governors()
+        return
+    shard = parse_shard(options.shard) if options.shard else None
+    # 每个分片从合并后的状态开始，保存到自己的状态文件中
+    sync_state.load()
+    if shard:
+        sync_state.path = get_shard_path("todo", *shard, "json")
+        journal.path = get_shard_path("journal", *shard, "jsonl")
+    try:
+        replay_journal()
+        sync(
+            session,
+            get_project_dict(),
+            get_todo_dict(),
+            deadline=deadline,
+            shard=shard,
+            low_memory=options.low_memory,
+            rebuild=options.rebuild,
+        )
+    finally:
+        sync_state.save()
+        journal.compact()
+        transport.save_governors()
 
 
-notion_helper = NotionHelper()
+notion_helper = LazyNotionHelper()
+date_dimension = DateDimension(notion_helper)
+sync_state = SyncState()
+stop_event = threading.Event()
+# 是否是大任务 -> [完成的数量, 总耗时]，daemon中多次同步之间保留
+task_durations = {False: [0, 0.0], True: [0, 0.0]}
+duration_lock = threading.Lock()
+journal = Journal()
+note_cache = NoteCache(notion_helper)
+markdown_pool = None
 if __name__ == "__main__":
     main()
@@ -0,0 +1,106 @@
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 请求超时时间（秒）
+TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 30))
+# 每个host的连接池大小，需要不小于并发的线程数
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 32))
+# 缓存连接池的host数量：滴答清单api、附件下载、Markdown转换服务、图片等
+POOL_HOSTS = 10
+ACCEPT_ENCODING = "gzip, deflate"
+
+_lock = threading.Lock()
+_session = None
+# 每个工作区的Governor
+_governors = {}
+
+
+class TimeoutSession(requests.Session):
+    """没有指定timeout的请求使用默认的超时时间"""
+
+    def __init__(self, timeout=TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def new_session():
+    session = TimeoutSession()
+    adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["accept-encoding"] = ACCEPT_ENCODING
+    return session
+
+
+def get_session():
+    """获取进程内共享的session，连接会被复用（keep-alive）"""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = new_session()
+        return _session
+
+
+def new_notion_client(auth, log_level=logging.ERROR):
+    """创建Notion client，NOTION_HTTP2=1并且安装了h2时使用HTTP/2"""
+    import httpx
+    from notion_client import Client
+
+    from todo2notion.governor import GovernedTransport
+
+    http2 = os.getenv("NOTION_HTTP2", "").lower() in ("1", "true")
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("没有安装h2，Notion client使用HTTP/1.1")
+            http2 = False
+    transport = httpx.HTTPTransport(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE
+        ),
+    )
+    http_client = httpx.Client(
+        transport=GovernedTransport(transport, get_governor(auth))
+    )
+    client = Client(
+        auth=auth,
+        client=http_client,
+        log_level=log_level,
+        timeout_ms=int(TIMEOUT * 1000),
+    )
+    # notion_client会重置httpx client的headers，需要重新加上gzip
+    http_client.headers["Accept-Encoding"] = ACCEPT_ENCODING
+    return client
+
+
+def get_governor(token):
+    """同一个工作区的Notion client共用一个Governor"""
+    from todo2notion.governor import Governor, get_workspace_key
+
+    workspace = get_workspace_key(token)
+    with _lock:
+        if workspace not in _governors:
+            _governors[workspace] = Governor(workspace).load()
+        return _governors[workspace]
+
+
+def get_governors():
+    with _lock:
+        return list(_governors.values())
+
+
+def save_governors():
+    """保存学到的速率并打印请求统计"""
+    for governor in get_governors():
+        governor.save()
+        print(governor.report())
@@ -1,5 +1,10 @@
+import argparse
 import os
-from todo2notion.notion_helper import NotionHelper
+from datetime import date, timedelta
+
+from todo2notion.notion_helper import LazyNotionHelper
+from todo2notion.state import SyncState
+from todo2notion import utils
 
 
 def get_file(dir):
@@ -13,7 +18,108 @@ def get_file(dir):
         return None
 
 
-def main():
+def rebuild_state(state):
+    """从Notion中读取所有任务的完成时间，重新生成本地状态"""
+    for todo in notion_helper.query_all(notion_helper.todo_database_id):
+        properties = todo.get("properties")
+        id = utils.get_property_value(properties.get("id"))
+        if not id:
+            continue
+        completed_time = None
+        if properties.get("完成时间"):
+            completed_time = utils.get_property_value(properties.get("完成时间")) or None
+        state.update_task(id, completed_time=completed_time)
+    state.rebuild_heatmap()
+    state.seeded = True
+
+
+def get_tracks(heatmap, years):
+    """生成每天的完成任务数，没有完成任务的日期为0"""
+    tracks = {}
+    for year in years:
+        day = date(year, 1, 1)
+        while day.year == year:
+            key = day.strftime("%Y-%m-%d")
+            tracks[key] = heatmap.get(key, 0)
+            day += timedelta(days=1)
+    return tracks
+
+
+def get_special_number(numbers):
+    """和github_heatmap一样，取前20%和20%-50%的值作为特殊颜色的阈值"""
+    number_list_set = sorted(set(numbers))
+    length = len(number_list_set)
+    if length < 3:
+        return float("inf"), float("inf")
+    if len(numbers) < 10:
+        return number_list_set[-1], number_list_set[-2]
+    return number_list_set[-1 * int(length * 0.2)], number_list_set[-1 * int(length * 0.5)]
+
+
+def draw_heatmap(heatmap, years, output, title, unit, colors):
+    from github_heatmap.config import (
+        DOM_BOX_PADING,
+        DOM_BOX_TUPLE,
+        HEAD_FONT_SIZE,
+        MARGIN_LEFT,
+        MARGIN_TOP,
+        MONTH_FONT_SIZE,
+        YEAR_FONT_SIZE,
+    )
+    from github_heatmap.drawer import Drawer
+    from github_heatmap.poster import Poster
+
+    tracks = get_tracks(heatmap, years)
+    p = Poster()
+    p.colors = colors
+    p.units = unit
+    p.set_tracks(tracks, years, ["notion"])
+    p.title = title
+    special_number1, special_number2 = get_special_number(list(tracks.values()))
+    p.special_number = {
+        "special_number1": special_number1,
+        "special_number2": special_number2,
+    }
+    p.width = MARGIN_LEFT * 2 + (DOM_BOX_PADING + DOM_BOX_TUPLE[0]) * 53
+    p.height = MARGIN_TOP + HEAD_FONT_SIZE + len(years) * (
+        YEAR_FONT_SIZE
+        + MONTH_FONT_SIZE
+        + DOM_BOX_PADING * 3
+        + (DOM_BOX_PADING + DOM_BOX_TUPLE[0]) * 7
+    )
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    p.draw(Drawer(p), output)
+
+
+def generate(options):
+    """根据本地同步状态生成热力图，不需要再读取Notion"""
+    state = SyncState().load()
+    # 同步过程中只记录重新写入的任务，没有从Notion读取过全部任务之前都要重新生成
+    if options.rebuild or not state.seeded:
+        rebuild_state(state)
+        state.save()
+    years = list(range(options.year[0], options.year[-1] + 1))
+    colors = {
+        "background": options.background_color,
+        "track": options.track_color,
+        "special": options.special_color1,
+        "special2": options.special_color2,
+        "text": options.text_color,
+        "dom": options.dom_color,
+    }
+    draw_heatmap(state.heatmap, years, options.output, options.me, options.unit, colors)
+    print(f"热力图已生成: {options.output}")
+
+
+def parse_years(value):
+    """支持 2024 或 2020-2024"""
+    years = [int(x) for x in value.split("-")]
+    return years
+
+
+def update_embed():
     dir = "heatmap/todo"
     block_id = notion_helper.todo_heatmap_block_id
     image_file = get_file(dir)
@@ -23,6 +129,34 @@ def main():
         if block_id:
             notion_helper.update_heatmap(block_id=block_id, url=heatmap_url)
 
-notion_helper = NotionHelper()
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "command", nargs="?", default="embed", choices=["embed", "generate"]
+    )
+    parser.add_argument(
+        "--year", type=parse_years, default=parse_years(str(date.today().year))
+    )
+    parser.add_argument("--output", default=os.path.join("OUT_FOLDER", "notion.svg"))
+    parser.add_argument("--me", default=os.getenv("TODO_NAME", ""))
+    parser.add_argument("--unit", default="个")
+    parser.add_argument("--rebuild", action="store_true", help="从Notion重新生成本地状态")
+    parser.add_argument("--background-color", default="#FFFFFF")
+    parser.add_argument("--track-color", default="#ACE7AE")
+    parser.add_argument("--special-color1", default="#69C16E")
+    parser.add_argument("--special-color2", default="#549F57")
+    parser.add_argument("--dom-color", default="#EBEDF0")
+    parser.add_argument("--text-color", default="#000000")
+    options = parser.parse_args()
+    if options.command == "generate":
+        generate(options)
+    else:
+        update_embed()
+
+notion_helper = LazyNotionHelper()
 if __name__ == "__main__":
     main()
@@ -1,12 +1,13 @@
 import calendar
+import copy
+import functools
 from datetime import datetime
 from datetime import timedelta
 import hashlib
+import json
 import os
 import re
 import time
-import requests
-import emoji
 from todo2notion.config import (
     RICH_TEXT,
     URL,
@@ -20,11 +21,13 @@ from todo2notion.config import (
     MULTI_SELECT,
     TZ
 )
-import pendulum
 
-MAX_LENGTH = (
-    1024  # NOTION 2000个字符限制https://developers.notion.com/reference/request-limits
-)
+# Notion的请求限制 https://developers.notion.com/reference/request-limits
+MAX_LENGTH = 2000  # 每个rich text的content最多2000个字符
+MAX_RICH_TEXT = 100  # rich text数组最多100个元素
+MAX_CHILDREN = 100  # 一次最多追加100个block
+MAX_PAYLOAD_SIZE = 500 * 1000  # 请求体最大500KB
+MAX_BLOCK_ELEMENTS = 1000  # 一次请求最多1000个block，包括嵌套的子block
 
 
 def log_request_duration(action, start_time):
@@ -34,6 +37,115 @@ def log_request_duration(action, start_time):
     print(f"{action}结束,耗时{minutes}分{seconds:.2f}秒")
 
 
+def split_text(content, limit=MAX_LENGTH):
+    """把文本切分成不超过limit的片段，长度按Notion使用的UTF-16计算"""
+    if len(content) <= limit // 2 or len(content.encode("utf-16-le")) <= limit * 2:
+        return [content]
+    result = []
+    start = 0
+    units = 0
+    for index, char in enumerate(content):
+        size = 2 if ord(char) > 0xFFFF else 1
+        if units + size > limit:
+            result.append(content[start:index])
+            start = index
+            units = 0
+        units += size
+    result.append(content[start:])
+    return result
+
+
+def get_rich_text_list(content):
+    """文本转化为rich text数组，超长的文本会被切分而不是截断"""
+    return [
+        {"type": "text", "text": {"content": x}}
+        for x in split_text(content)[:MAX_RICH_TEXT]
+    ]
+
+
+def split_rich_text(rich_text):
+    """切分超长的rich text，切分后的每一段保留原来的样式和链接"""
+    result = []
+    for item in rich_text:
+        text = item.get("text") if item.get("type") == "text" else None
+        content = text.get("content") if text else None
+        if not content or len(content) <= MAX_LENGTH // 2:
+            result.append(item)
+            continue
+        for x in split_text(content):
+            new_item = copy.deepcopy(item)
+            new_item["text"]["content"] = x
+            result.append(new_item)
+    return result
+
+
+def split_block(block):
+    """切分block中超长的rich text，超过100个元素时拆成多个相邻的同类型block"""
+    type = block.get("type") if block else None
+    value = block.get(type) if type else None
+    if type == "table_row":
+        value["cells"] = [
+            split_rich_text(cell)[:MAX_RICH_TEXT] for cell in value.get("cells")
+        ]
+        return [block]
+    if type == "table":
+        # 表格的行和表格一起创建，需要在这里处理
+        for row in value.get("children") or []:
+            split_block(row)
+        return [block]
+    if not isinstance(value, dict) or not value.get("rich_text"):
+        return [block]
+    rich_text = split_rich_text(value.get("rich_text"))
+    if len(rich_text) <= MAX_RICH_TEXT:
+        value["rich_text"] = rich_text
+        return [block]
+    blocks = []
+    for i in range(0, len(rich_text), MAX_RICH_TEXT):
+        if i == 0:
+            new_block = block
+        else:
+            # 子block只保留在第一个block上
+            new_block = {
+                k: v for k, v in block.items() if k not in ("children", "id")
+            }
+            new_block[type] = {k: v for k, v in value.items() if k != "children"}
+        new_block[type]["rich_text"] = rich_text[i : i + MAX_RICH_TEXT]
+        blocks.append(new_block)
+    return blocks
+
+
+def get_payload_size(children):
+    return len(json.dumps(children, ensure_ascii=False).encode("utf-8"))
+
+
+def get_block_count(children):
+    """children中block的数量，包括嵌套的子block，比如表格中的行"""
+    count = 0
+    for block in children:
+        count += 1
+        value = block.get(block.get("type"))
+        count += get_block_count(block.get("children") or [])
+        if isinstance(value, dict):
+            count += get_block_count(value.get("children") or [])
+    return count
+
+
+def split_children(children):
+    """请求体大小或者block数量超过限制时把children拆成多个请求"""
+    if (
+        get_payload_size(children) <= MAX_PAYLOAD_SIZE
+        and get_block_count(children) <= MAX_BLOCK_ELEMENTS
+    ):
+        return [children]
+    if len(children) == 1:
+        # 发送之前就失败，避免请求失败后再重试
+        raise ValueError(
+            f"block {children[0].get('type')} 超过Notion请求大小限制，无法追加"
+        )
+    middle = len(children) // 2
+    return split_children(children[:middle]) + split_children(children[middle:])
+
+
 def get_heading(level, content):
     if level == 1:
         heading = "heading_1"
@@ -44,14 +156,7 @@ def get_heading(level, content):
     return {
         "type": heading,
         heading: {
-            "rich_text": [
-                {
-                    "type": "text",
-                    "text": {
-                        "content": content[:MAX_LENGTH],
-                    },
-                }
-            ],
+            "rich_text": get_rich_text_list(content),
             "color": "default",
             "is_toggleable": False,
         },
@@ -64,11 +169,11 @@ def get_table_of_contents():
 
 
 def get_title(content):
-    return {"title": [{"type": "text", "text": {"content": content[:MAX_LENGTH]}}]}
+    return {"title": get_rich_text_list(content)}
 
 
 def get_rich_text(content):
-    return {"rich_text": [{"type": "text", "text": {"content": content[:MAX_LENGTH]}}]}
+    return {"rich_text": get_rich_text_list(content)}
 
 
 def get_url(url):
@@ -113,12 +218,7 @@ def get_quote(content):
     return {
         "type": "quote",
         "quote": {
-            "rich_text": [
-                {
-                    "type": "text",
-                    "text": {"content": content[:MAX_LENGTH]},
-                }
-            ],
+            "rich_text": get_rich_text_list(content),
             "color": "default",
         },
     }
@@ -197,17 +297,9 @@ def get_properties(dict1, dict2):
             continue
         property = None
         if type == TITLE:
-            property = {
-                "title": [
-                    {"type": "text", "text": {"content": value[:MAX_LENGTH]}}
-                ]
-            }
+            property = {"title": get_rich_text_list(value)}
         elif type == RICH_TEXT:
-            property = {
-                "rich_text": [
-                    {"type": "text", "text": {"content": value[:MAX_LENGTH]}}
-                ]
-            }
+            property = {"rich_text": get_rich_text_list(value)}
         elif type == NUMBER:
             property = {"number": value}
         elif type == STATUS:
@@ -215,6 +307,8 @@ def get_properties(dict1, dict2):
         elif type == FILES:
             property = {"files": [{"type": "external", "name": "Cover", "external": {"url": value}}]}
         elif type == DATE:
+            import pendulum
+
             property = {
                 "date": {
                     "start": pendulum.from_timestamp(
@@ -246,7 +340,8 @@ def get_property_value(property):
         return None
     if type == "title" or type == "rich_text":
         if(len(content)>0):
-            return content[0].get("plain_text")
+            # 写入时长文本被拆成了多段，读取时拼接起来
+            return "".join(x.get("plain_text") or "" for x in content)
         else:
             return None
     elif type == "status" or type == "select":
@@ -307,6 +402,8 @@ def get_weread_url(book_id):
 def str_to_timestamp(date):
     if date == None:
         return 0
+    import pendulum
+
     dt = pendulum.parse(date)
     # 获取时间戳
     return int(dt.timestamp())
@@ -344,11 +441,13 @@ def download_image(url, save_dir="cover"):
     action = f"下载图片 {url}"
     print(f"开始{action}")
     start_time = time.time()
-    response = requests.get(url, stream=True)
+    from todo2notion import transport
+
+    response = transport.get_session().get(url, stream=True)
     log_request_duration(action, start_time)
     if response.status_code == 200:
         with open(save_path, "wb") as file:
-            for chunk in response.iter_content(chunk_size=128):
+            for chunk in response.iter_content(chunk_size=64 * 1024):
                 file.write(chunk)
         print(f"Image downloaded successfully to {save_path}")
     else:
@@ -356,15 +455,51 @@ def download_image(url, save_dir="cover"):
     return save_path
 
 def parse_date(date_str):
-        # get_task()
+    import pendulum
+
     return pendulum.parse(date_str).int_timestamp
 
+_emoji_tree = None
+
+
+def get_emoji_tree():
+    """根据emoji的数据构建前缀树，只在第一次调用时构建"""
+    global _emoji_tree
+    if _emoji_tree is None:
+        import emoji
+
+        tree = {}
+        for e in emoji.EMOJI_DATA:
+            node = tree
+            for char in e:
+                node = node.setdefault(char, {})
+            # 空字符串不会是单个字符，用来标记一个完整的emoji
+            node[""] = True
+        _emoji_tree = tree
+    return _emoji_tree
+
+
+def match_emoji(s, stop_at_zwj=False):
+    """返回开头emoji的长度，没有emoji时返回0"""
+    node = get_emoji_tree()
+    end = 0
+    for char in s:
+        if char not in node or (stop_at_zwj and char == "\u200d"):
+            break
+        node = node[char]
+        end += 1
+    return end if end and "" in node else 0
+
+
+@functools.lru_cache(maxsize=4096)
 def split_emoji_from_string(s):
-    # 检查第一个字符是否是emoji
-    l = list(filter(lambda x: x.get("match_start")==0,emoji.emoji_list(s)))
-    if len(l)>0:
-        # 如果整个字符串都是emoji
-        return l[0].get("emoji"), s[l[0].get("match_end"):]
-    else:
-        # 如果字符串不是以emoji开头
-        return '✅', s
+    """拆分开头的emoji和后面的文字，只检查开头的字符
+
+    和emoji.emoji_list一样贪婪地沿着前缀树匹配，非标准的ZWJ组合匹配
+    失败时只匹配ZWJ之前的emoji。
+    """
+    end = match_emoji(s) or match_emoji(s, stop_at_zwj=True)
+    if end:
+        return s[:end], s[end:]
+    # 如果字符串不是以emoji开头
+    return '✅', s
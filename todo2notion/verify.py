@@ -0,0 +1,149 @@
+import hashlib
+
+from todo2notion import todo, utils
+
+
+def get_digest(fingerprints):
+    """一组任务的摘要，fingerprints是id -> 指纹"""
+    value = "\n".join(f"{id}:{fingerprints[id]}" for id in sorted(fingerprints))
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+def get_page_fingerprint(page):
+    """Notion页面中保存的指纹，database中没有指纹属性时使用本地状态"""
+    properties = page.get("properties")
+    id = utils.get_property_value(properties.get("id"))
+    fingerprint = None
+    if properties.get("指纹"):
+        fingerprint = utils.get_property_value(properties.get("指纹"))
+    return fingerprint or (todo.sync_state.get_task(id) or {}).get("fingerprint")
+
+
+def is_page_consistent(page, task):
+    """页面是否和任务一致，无法判断时返回None
+
+    没有指纹时（database中没有指纹属性，本地也没有状态）比较最后修改时间，
+    和同步时判断任务是否被修改的方式一样。
+    """
+    fingerprint = get_page_fingerprint(page)
+    if fingerprint:
+        return fingerprint == task.fingerprint
+    property = page.get("properties").get("最后修改时间")
+    modified_time = utils.get_property_value(property) if property else None
+    if modified_time is None or task.modified_time is None:
+        return None
+    return modified_time == task.modified_time
+
+
+def get_project_pages(notion_helper, project_dict, project_id, ids, status_type):
+    """查询一个清单在Notion中没有完成的任务"""
+    project = project_dict.get(project_id)
+    if not project:
+        # 收集箱等没有清单页面的任务只能按id逐个查找
+        return [
+            page
+            for id in ids
+            for page in notion_helper.find_pages(notion_helper.todo_database_id, ("id", id))
+        ]
+    filter = {"property": "清单", "relation": {"contains": project.get("id")}}
+    if status_type:
+        # 滴答清单只返回没有完成的任务，Notion中已完成的不参与比较
+        filter = {
+            "and": [
+                filter,
+                {"property": "状态", status_type: {"does_not_equal": "Done"}},
+            ]
+        }
+    return notion_helper.query_all_by_book(notion_helper.todo_database_id, filter)
+
+
+def get_children_pages(notion_helper, tasks, todo_dict):
+    """子任务的页面没有关联清单，按父任务查询，重新同步时才能找到旧页面"""
+    for task in tasks:
+        page = todo_dict.get(task.id)
+        if not task.items or not page:
+            continue
+        filter = {"property": "Parent task", "relation": {"contains": page.get("id")}}
+        for child in notion_helper.query_all_by_book(notion_helper.todo_database_id, filter):
+            todo_dict[utils.get_property_value(child.get("properties").get("id"))] = child
+
+
+def verify(session, notion_helper, remote=False, dry_run=False):
+    """检查Notion和滴答清单是否一致，只重新同步不一致的任务，返回这些任务的id
+
+    先按清单计算滴答清单中任务指纹的摘要，和本地状态中记录的指纹的摘要比较，
+    摘要不同的清单才查询Notion，逐个比较任务找出不一致的id。remote为True时
+    不使用本地状态，所有清单都查询Notion。
+    """
+    project_dict = todo.get_project_dict()
+    tasks, _ = todo.get_all_task(session)
+    task_dict = {x.id: x for x in tasks}
+    dida = {}
+    for task in tasks:
+        dida.setdefault(task.project_id, {})[task.id] = task.fingerprint
+    if remote:
+        projects = list(dida)
+    else:
+        projects = []
+        for project_id, fingerprints in dida.items():
+            local = {
+                id: (todo.sync_state.get_task(id) or {}).get("fingerprint")
+                for id in fingerprints
+            }
+            if get_digest(local) != get_digest(fingerprints):
+                projects.append(project_id)
+        print(f"{len(dida)}个清单中{len(projects)}个和本地状态不一致")
+    status_type = notion_helper.get_property_type(notion_helper.todo_database_id).get(
+        "状态"
+    )
+    todo_dict = {}
+    mismatched = []
+    unverifiable = []
+    for project_id in projects:
+        fingerprints = dida.get(project_id)
+        pages = {}
+        for page in get_project_pages(
+            notion_helper, project_dict, project_id, fingerprints, status_type
+        ):
+            pages[utils.get_property_value(page.get("properties").get("id"))] = page
+        extra = [id for id in pages if id not in fingerprints]
+        if status_type and project_id in project_dict:
+            # 在Notion中已经完成的页面不在查询结果中，按id查找，
+            # 重新同步时替换这些页面，不会再创建一个新页面
+            for id in fingerprints.keys() - pages.keys():
+                for page in notion_helper.find_pages(
+                    notion_helper.todo_database_id, ("id", id)
+                ):
+                    pages[id] = page
+        todo_dict.update(pages)
+        ids = []
+        for id in fingerprints:
+            consistent = False
+            if id in pages:
+                consistent = is_page_consistent(pages[id], task_dict.get(id))
+            if consistent is None:
+                # 没有指纹也没有最后修改时间，不重新同步，避免重写所有任务
+                unverifiable.append(id)
+            elif not consistent:
+                ids.append(id)
+            elif not dry_run:
+                # 本地状态过期但Notion是一致的，更新本地状态，下次不用再查询
+                todo.sync_state.update_task(id, fingerprint=fingerprints.get(id))
+        if ids or extra:
+            project = project_dict.get(project_id)
+            name = project_id
+            if project:
+                name = utils.get_property_value(project.get("properties").get("标题"))
+            print(f"{name}: {len(ids)}个任务不一致，Notion中多出{len(extra)}个未完成的任务")
+        mismatched.extend(ids)
+    if unverifiable:
+        print(f"{len(unverifiable)}个任务没有指纹和最后修改时间，无法比较")
+    print(f"共{len(mismatched)}个任务需要重新同步")
+    if dry_run or not mismatched:
+        return mismatched
+    tasks = [task_dict.get(id) for id in mismatched]
+    get_children_pages(notion_helper, tasks, todo_dict)
+    todo.add_task_to_notion(
+        tasks, project_dict, todo_dict, session, force=set(mismatched)
+    )
+    return mismatched
@@ -0,0 +1,94 @@
+import hashlib
+import hmac
+import json
+import os
+import threading
+
+# 只有这些事件会影响任务页面或笔记内容
+NOTION_PAGE_EVENTS = (
+    "page.content_updated",
+    "page.properties_updated",
+    "page.created",
+    "page.undeleted",
+    "page.moved",
+)
+
+
+def normalize_id(id):
+    return id.replace("-", "") if id else id
+
+
+class WebhookReceiver:
+    """接收Notion和滴答清单的变更通知，把受影响的id放入待同步队列"""
+
+    def __init__(self, wake_event, notion_secret=None, dida_token=None):
+        self.wake_event = wake_event
+        self.notion_secret = notion_secret or os.getenv("NOTION_WEBHOOK_SECRET")
+        self.dida_token = dida_token or os.getenv("DIDA_WEBHOOK_TOKEN")
+        self.lock = threading.Lock()
+        self.page_ids = set()
+        self.task_ids = set()
+
+    def has_pending(self):
+        with self.lock:
+            return bool(self.page_ids or self.task_ids)
+
+    def drain(self):
+        """取出所有待同步的Notion页面id和滴答清单任务id"""
+        with self.lock:
+            page_ids, self.page_ids = self.page_ids, set()
+            task_ids, self.task_ids = self.task_ids, set()
+        return page_ids, task_ids
+
+    def enqueue(self, page_ids=(), task_ids=()):
+        with self.lock:
+            self.page_ids.update(normalize_id(x) for x in page_ids)
+            self.task_ids.update(task_ids)
+        self.wake_event.set()
+
+    def is_protected(self):
+        """两个来源都配置了校验，没有配置时所有请求都会被接受"""
+        return bool(self.notion_secret and self.dida_token)
+
+    def verify_notion_signature(self, body, signature):
+        if not self.notion_secret:
+            return True
+        expected = "sha256=" + hmac.new(
+            self.notion_secret.encode("utf-8"), body, hashlib.sha256
+        ).hexdigest()
+        return hmac.compare_digest(expected, signature or "")
+
+    def handle_notion(self, body, headers):
+        """处理Notion的webhook事件，返回(状态码, 响应内容)"""
+        try:
+            event = json.loads(body)
+        except ValueError:
+            return 400, {"error": "invalid json"}
+        if "verification_token" in event:
+            # 订阅webhook时Notion会先发送一个verification_token，需要填回Notion
+            print(f"收到Notion webhook verification_token: {event['verification_token']}")
+            return 200, {"ok": True}
+        if not self.verify_notion_signature(body, headers.get("X-Notion-Signature")):
+            return 401, {"error": "invalid signature"}
+        entity = event.get("entity") or {}
+        if event.get("type") not in NOTION_PAGE_EVENTS or entity.get("type") != "page":
+            return 200, {"ignored": True}
+        self.enqueue(page_ids=[entity.get("id")])
+        return 202, {"queued": 1}
+
+    def handle_dida(self, body, headers):
+        """处理滴答清单的变更通知，支持{"taskIds": [...]}或{"tasks": [{"id": ...}]}"""
+        if self.dida_token and not hmac.compare_digest(
+            self.dida_token, headers.get("X-Webhook-Token") or ""
+        ):
+            return 401, {"error": "invalid token"}
+        try:
+            event = json.loads(body)
+        except ValueError:
+            return 400, {"error": "invalid json"}
+        task_ids = list(event.get("taskIds") or [])
+        task_ids.extend(x.get("id") for x in event.get("tasks") or [] if x.get("id"))
+        if not task_ids:
+            return 200, {"ignored": True}
+        self.enqueue(task_ids=task_ids)
+        return 202, {"queued": len(task_ids)}